@@ -0,0 +1,86 @@
+"""Equivalence check and benchmark of spacy and fast matching engines"""
+
+import argparse
+import sys
+import time
+
+from common import PATTERNS_PATH, TEMPLATE, load_renamer
+from corpus import SCALES, generate_names, parse_scale
+
+
+def run_engine(renamer, texts, template_str: str, mandatory, batch_size: int):
+    """
+    Runs engine twice, first only the pipeline and then together with generating new
+    file names. Documents are not kept, like in a real run.
+
+    Returns:
+        tuple: (entities, new_names, pipeline_seconds, total_seconds) tuple
+    """
+
+    nlp = renamer.nlp_data["nlp"]
+
+    start = time.perf_counter()
+    for _ in nlp.pipe(texts, batch_size=batch_size):
+        pass
+    pipeline = time.perf_counter() - start
+
+    entities = []
+    new_names = []
+    start = time.perf_counter()
+    for doc in nlp.pipe(texts, batch_size=batch_size):
+        new_names.append(renamer.get_new_file_name(doc, mandatory, template_str))
+        entities.append([(e.label_, e.start, e.end, e.text) for e in doc.ents])
+    total = time.perf_counter() - start
+
+    return entities, new_names, pipeline, total
+
+
+def main():
+    """The main function"""
+
+    parser = argparse.ArgumentParser(description='spacy and fast engine comparison')
+    parser.add_argument('-n', '--scale', type=parse_scale, default='100k',
+                        help=f"Number of file names, one of {', '.join(SCALES)} or a number (default: 100k)")
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of corpus (default: 0)')
+    parser.add_argument('-l', '--load', type=str, default=PATTERNS_PATH,
+                        help='Patterns file (default: samples/patterns.yaml)')
+    parser.add_argument('-t', '--template', type=str, default=TEMPLATE,
+                        help='Template used to render new file names')
+    parser.add_argument('-m', '--mandatory', type=str, nargs='+', default=['volume'],
+                        help='Mandatory fields (default: volume)')
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help='Batch size of spacy pipeline (default: 1000)')
+    parser.add_argument('--show', type=int, default=10,
+                        help='Number of differences to show (default: 10)')
+    args = parser.parse_args()
+
+    renamer = load_renamer()
+    texts = [renamer.preprocess_file_name(name, None) for name in generate_names(args.scale, args.seed)]
+
+    results = {}
+    for engine, init in (("spacy", renamer.nlp_init), ("fast", renamer.fast_init)):
+        init(args.load)
+        renamer.handler_memos.clear()
+        results[engine] = run_engine(renamer, texts, args.template, args.mandatory, args.batch_size)
+        _, _, pipeline, total = results[engine]
+        print(f":: {engine:6} pipeline {pipeline:8.3f} s, with new file names {total:8.3f} s "
+              f"{len(texts) / total:10.0f} files/s")
+
+    spacy_entities, spacy_names, spacy_pipeline, spacy_total = results["spacy"]
+    fast_entities, fast_names, fast_pipeline, fast_total = results["fast"]
+    print(f":: Speedup pipeline {spacy_pipeline / fast_pipeline:.1f}x, "
+          f"with new file names {spacy_total / fast_total:.1f}x")
+
+    differences = [i for i in range(len(texts))
+                   if spacy_entities[i] != fast_entities[i] or spacy_names[i] != fast_names[i]]
+    for i in differences[:args.show]:
+        print(f":: {texts[i]}\n::   spacy: {spacy_entities[i]} -> {spacy_names[i]}"
+              f"\n::   fast:  {fast_entities[i]} -> {fast_names[i]}")
+    print(f":: {len(differences)} of {len(texts)} file names differ")
+
+    if differences:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
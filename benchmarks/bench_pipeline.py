@@ -0,0 +1,202 @@
+"""
+Benchmark of every stage of extracting and renaming on a synthetic corpus.
+Stages are timed separately and results can be saved as JSON and compared
+with an earlier run to catch regressions.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from common import PATTERNS_PATH, TEMPLATE, load_renamer
+from corpus import FILES_PER_DIR, SCALES, create_tree, generate_names, parse_scale
+
+STAGES = ("traversal", "preprocessing", "tokenization", "matching",
+          "value_extraction", "rendering", "renaming")
+CHUNK_SIZE = 10000
+
+
+def tmpfs_dir():
+    """Returns directory on tmpfs if available so that renaming is not disk bound"""
+
+    return '/dev/shm' if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK) else None
+
+
+def run_stages(renamer, entries, root: str, template_str: str, mandatory):
+    """
+    Runs all the stages and returns time spent in each of them
+
+    Args:
+        renamer: multi-file-renamer module
+        entries (list): (dir_name, file_name) tuples of corpus files
+        root (str): directory containing corpus files
+        template_str (str): template used for rendering new file names
+        mandatory (List[str]): mandatory fields
+
+    Returns:
+        tuple: (timers, counts) Counters with seconds spent and items processed per stage
+    """
+
+    timers = Counter()
+    counts = Counter()
+    nlp = renamer.nlp_data["nlp"]
+    template = renamer.compile_template(template_str)
+
+    start = time.perf_counter()
+    walked = list(renamer.file_generator([root]))
+    timers["traversal"] += time.perf_counter() - start
+    counts["traversal"] += len(walked)
+    assert len(walked) == len(entries), "traversal did not find all the corpus files"
+
+    file_data = []
+    for offset in range(0, len(entries), CHUNK_SIZE):
+        chunk = entries[offset:offset + CHUNK_SIZE]
+
+        start = time.perf_counter()
+        texts = [renamer.preprocess_file_name(file_name, None) for _, file_name in chunk]
+        timers["preprocessing"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        docs = [nlp.make_doc(text) for text in texts]
+        timers["tokenization"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _, component in nlp.pipeline:
+            docs = [component(doc) for doc in docs]
+        timers["matching"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        values = []
+        for doc in docs:
+            results = {}
+            for e in doc.ents:
+                results.update(e._.actual_value)
+            values.append(results)
+        timers["value_extraction"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        for (dir_name, file_name), results in zip(chunk, values):
+            if mandatory is None or all(m in results for m in mandatory):
+                file_data.append((dir_name, file_name, template(results)))
+            else:
+                file_data.append((dir_name, file_name, None))
+        timers["rendering"] += time.perf_counter() - start
+
+        for stage in ("preprocessing", "tokenization", "matching", "value_extraction", "rendering"):
+            counts[stage] += len(chunk)
+
+    start = time.perf_counter()
+    renamed, _, failed = renamer.rename_files(iter(file_data))
+    timers["renaming"] += time.perf_counter() - start
+    counts["renaming"] += len(renamed)
+    assert not failed, "some files could not be renamed"
+
+    return timers, counts
+
+
+def compare(results, baseline_path: str, tolerance: float):
+    """Prints stage times relative to baseline, returns True if any stage regressed"""
+
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+
+    if baseline["files"] != results["files"]:
+        print(f":: Baseline has {baseline['files']} files, current run {results['files']}")
+
+    regressed = False
+    for stage, current in results["stages"].items():
+        previous = baseline["stages"].get(stage)
+        if previous is None or not previous["seconds"]:
+            continue
+        ratio = current["seconds"] / previous["seconds"]
+        slow = ratio > tolerance
+        regressed = regressed or slow
+        print(f":: {stage:17} {previous['seconds']:9.3f} s -> {current['seconds']:9.3f} s "
+              f"({ratio:5.2f}x){'  REGRESSION' if slow else ''}")
+
+    return regressed
+
+
+def main():
+    """The main function"""
+
+    parser = argparse.ArgumentParser(description='pipeline stages benchmark')
+    parser.add_argument('-n', '--scale', type=parse_scale, default='10k',
+                        help=f"Number of files, one of {', '.join(SCALES)} or a number (default: 10k)")
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of corpus (default: 0)')
+    parser.add_argument('-l', '--load', type=str, default=PATTERNS_PATH,
+                        help='Patterns file (default: samples/patterns.yaml)')
+    parser.add_argument('-t', '--template', type=str, default=TEMPLATE,
+                        help='Template used to render new file names')
+    parser.add_argument('-m', '--mandatory', type=str, nargs='+', default=['volume'],
+                        help='Mandatory fields (default: volume)')
+    parser.add_argument('--dir', type=str, default=tmpfs_dir(),
+                        help='Directory in which corpus is created (default: /dev/shm if available)')
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help='Save results as JSON to this file')
+    parser.add_argument('--compare', type=str, default=None,
+                        help='JSON results of earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=1.2,
+                        help='Slowdown ratio reported as regression by --compare (default: 1.2)')
+    args = parser.parse_args()
+
+    renamer = load_renamer()
+
+    start = time.perf_counter()
+    renamer.nlp_init(args.load)
+    init_time = time.perf_counter() - start
+
+    root = tempfile.mkdtemp(prefix='mfr-bench-', dir=args.dir)
+    try:
+        start = time.perf_counter()
+        entries = create_tree(root, generate_names(args.scale, args.seed), FILES_PER_DIR)
+        setup_time = time.perf_counter() - start
+        print(f":: Created {len(entries)} files in {root} in {setup_time:.3f} s")
+
+        timers, counts = run_stages(renamer, entries, root, args.template, args.mandatory)
+    finally:
+        shutil.rmtree(root)
+
+    import spacy
+
+    results = {
+        "scale": args.scale,
+        "seed": args.seed,
+        "files": len(entries),
+        "python": platform.python_version(),
+        "spacy": spacy.__version__,
+        "init_seconds": init_time,
+        "stages": {
+            stage: {
+                "seconds": timers[stage],
+                "items": counts[stage],
+                "items_per_second": counts[stage] / timers[stage] if timers[stage] else None,
+            } for stage in STAGES
+        },
+        "total_seconds": sum(timers.values()),
+    }
+
+    print(f":: {'init':17} {init_time:9.3f} s")
+    for stage in STAGES:
+        result = results["stages"][stage]
+        print(f":: {stage:17} {result['seconds']:9.3f} s {result['items_per_second'] or 0:12.0f} items/s")
+    print(f":: {'total':17} {results['total_seconds']:9.3f} s "
+          f"{len(entries) / results['total_seconds']:12.0f} files/s")
+
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
+        print(f":: Saved results to {args.output}")
+
+    if args.compare is not None and compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Benchmark of rename executor on simulated slow (network) file system"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from common import load_renamer
+
+
+def create_tree(root: str, dirs: int, files: int):
+    """Creates directories with files, half of files in each directory collide on new name"""
+
+    file_data = []
+    for d in range(dirs):
+        dir_name = os.path.join(root, f"dir{d:04d}")
+        os.makedirs(dir_name)
+        for f in range(files):
+            file_name = f"file{f:05d}.pdf"
+            with open(os.path.join(dir_name, file_name), 'w', encoding='utf-8'):
+                pass
+            file_data.append((dir_name, file_name, f"Volume_{f // 2:05d}.pdf"))
+
+    return file_data
+
+
+def snapshot(root: str):
+    """Returns sorted list of relative paths of all the files in tree"""
+
+    return sorted(os.path.relpath(os.path.join(d, f), root)
+                  for d, _, files in os.walk(root) for f in files)
+
+
+def main():
+    """The main function"""
+
+    parser = argparse.ArgumentParser(description='rename executor benchmark')
+    parser.add_argument('--dirs', type=int, default=16, help='Number of directories (default: 16)')
+    parser.add_argument('--files', type=int, default=50, help='Number of files per directory (default: 50)')
+    parser.add_argument('--latency', type=float, default=0.002,
+                        help='Latency in seconds added to every file system operation (default: 0.002)')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16],
+                        help='Rename worker counts to compare (default: 1 4 16)')
+    args = parser.parse_args()
+
+    renamer = load_renamer()
+    expected = None
+
+    for workers in args.workers:
+        root = tempfile.mkdtemp(prefix='mfr-bench-')
+        try:
+            file_data = create_tree(root, args.dirs, args.files)
+            fs = renamer.LatencyFileSystem(renamer.LocalFileSystem(), args.latency)
+
+            start = time.perf_counter()
+            renamed, _, failed = renamer.rename_files(iter(file_data), workers, fs)
+            elapsed = time.perf_counter() - start
+
+            result = snapshot(root)
+            expected = expected or result
+            assert result == expected, "rename result differs between worker counts"
+            assert not failed
+
+            print(f":: workers {workers:3}: renamed {len(renamed)} files in {elapsed:7.3f} s "
+                  f"({len(renamed) / elapsed:9.1f} files/s)")
+        finally:
+            shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
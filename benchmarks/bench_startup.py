@@ -0,0 +1,122 @@
+"""Benchmark of command start up time and modules imported by each command"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import SCRIPT_PATH
+
+HEAVY_MODULES = ('spacy', 'thinc', 'jinja2', 'yaml', 'dateutil')
+
+
+def create_rename_data(root: str, files: int):
+    """Creates files and file names mapping for rename from command"""
+
+    names = {root: {}}
+    for f in range(files):
+        file_name = f"file{f:03d}.pdf"
+        with open(os.path.join(root, file_name), 'w', encoding='utf-8'):
+            pass
+        names[root][file_name] = f"Volume_{f:03d}.pdf"
+
+    load_path = os.path.join(root, 'file_names.json')
+    with open(load_path, 'w', encoding='utf-8') as f:
+        json.dump(names, f)
+
+    return load_path
+
+
+def reset_rename_data(root: str):
+    """Renames files back to original names so that rename from can be run again"""
+
+    for file_name in os.listdir(root):
+        if file_name.startswith('Volume_'):
+            os.rename(os.path.join(root, file_name),
+                      os.path.join(root, f"file{file_name[7:]}"))
+        elif file_name.endswith('.journal'):
+            os.remove(os.path.join(root, file_name))
+
+
+def imported_modules(command):
+    """Runs command with -X importtime and returns {module: cumulative import time in us}"""
+
+    result = subprocess.run([sys.executable, '-X', 'importtime', SCRIPT_PATH, *command],
+                            capture_output=True, text=True, check=True)
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = int(cumulative)
+
+    return modules
+
+
+def wall_time(command, repeat: int, before=None):
+    """Returns best wall clock time of running command"""
+
+    best = None
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        start = time.perf_counter()
+        subprocess.run([sys.executable, SCRIPT_PATH, *command], capture_output=True, check=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def main():
+    """The main function"""
+
+    parser = argparse.ArgumentParser(description='command start up benchmark')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Number of runs of each command, best is reported (default: 5)')
+    parser.add_argument('--limit', type=float, default=0.2,
+                        help='Maximum allowed start up time in seconds (default: 0.2)')
+    parser.add_argument('--files', type=int, default=10,
+                        help='Number of files renamed by rename from (default: 10)')
+    args = parser.parse_args()
+
+    baseline = None
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
+        elapsed = time.perf_counter() - start
+        baseline = elapsed if baseline is None else min(baseline, elapsed)
+    print(f":: {'python -c pass':30} {baseline * 1000:7.1f} ms")
+
+    failed = False
+    with tempfile.TemporaryDirectory() as root:
+        load_path = create_rename_data(root, args.files)
+        restore_path = os.path.join(root, 'restore_data.json')
+        commands = (
+            ("--help", ['--help'], None),
+            ("rename from --help", ['rename', 'from', '--help'], None),
+            ("client --help", ['client', '--help'], None),
+            ("rename from", ['rename', 'from', '-l', load_path, '-s', restore_path],
+             lambda: reset_rename_data(root)),
+        )
+
+        for name, command, before in commands:
+            if before is not None:
+                before()
+            heavy = sorted(m for m in imported_modules(command) if m.split('.')[0] in HEAVY_MODULES
+                           and '.' not in m)
+            elapsed = wall_time(command, args.repeat, before)
+            slow = elapsed > args.limit
+            failed = failed or slow or bool(heavy)
+            print(f":: {name:30} {elapsed * 1000:7.1f} ms{'  SLOW' if slow else ''}"
+                  f"{'  imports ' + ', '.join(heavy) if heavy else ''}")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""Micro-benchmark of per-file template rendering cost"""
+
+import argparse
+import timeit
+
+from jinja2 import Environment
+
+from common import TEMPLATE as JINJA_TEMPLATE, load_renamer
+
+SIMPLE_TEMPLATE = "The_Review_Volume_{{volume}}_No_{{number}}_{{year}}_{{month}}.pdf"
+FIELDS = {"volume": "39", "number": "1-6", "year": "1926", "month": "July-December"}
+
+
+def render_per_file(template_str: str):
+    """Template compilation inside the hot loop, as done before compile_template"""
+
+    return Environment().from_string(template_str).render(**FIELDS)
+
+
+def main():
+    """The main function"""
+
+    parser = argparse.ArgumentParser(description='template rendering benchmark')
+    parser.add_argument('-n', '--number', type=int, default=10000,
+                        help='Number of renders per measurement (default: 10000)')
+    args = parser.parse_args()
+
+    renamer = load_renamer()
+
+    for name, template_str in (("jinja", JINJA_TEMPLATE), ("simple", SIMPLE_TEMPLATE)):
+        compiled = renamer.compile_template(template_str)
+        jinja_template = Environment().from_string(template_str)
+        assert compiled(FIELDS) == render_per_file(template_str)
+
+        before = timeit.timeit(lambda: render_per_file(template_str), number=args.number)
+        jinja = timeit.timeit(lambda: jinja_template.render(**FIELDS), number=args.number)
+        after = timeit.timeit(lambda: compiled(FIELDS), number=args.number)
+        print(f":: {name:6} template: per file compile {before / args.number * 1e6:9.2f} us, "
+              f"precompiled jinja {jinja / args.number * 1e6:7.2f} us, "
+              f"compile_template {after / args.number * 1e6:7.2f} us, speedup {before / after:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
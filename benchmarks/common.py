@@ -0,0 +1,21 @@
+"""Helpers shared by benchmarks"""
+
+import importlib.util
+import os
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT_PATH = os.path.join(ROOT_DIR, 'multi-file-renamer.py')
+PATTERNS_PATH = os.path.join(ROOT_DIR, 'samples', 'patterns.yaml')
+
+TEMPLATE = "The_Review{% if volume is defined %}_,Volume_{{'%03d'|format(volume|int)}}{% endif %}" \
+    "{% if number is defined %},No_{{number}}{% endif %}{% if year is defined %},({{year}}){% endif %}" \
+    "{% if month is defined %},({{month}}){% endif %}.pdf"
+
+
+def load_renamer():
+    """Loads multi-file-renamer.py as a module"""
+
+    spec = importlib.util.spec_from_file_location('multi_file_renamer', SCRIPT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,166 @@
+"""Generator of synthetic periodical style file names matching samples/patterns.yaml"""
+
+import argparse
+import os
+import random
+import sys
+
+SCALES = {'10k': 10_000, '100k': 100_000, '1M': 1_000_000}
+FILES_PER_DIR = 1000
+
+TITLES = ["The Review", "the review", "Scientific Monthly", "The Journal of Geography",
+          "Popular Astronomy", "Bulletin", "The Art Quarterly", "Harper's Magazine"]
+VOLUME_WORDS = ["vol", "Vol", "Vol.", "VOL", "volume", "Volume", "VolNo", "volno."]
+NUMBER_WORDS = ["no", "No.", "nos", "Nos", "number", "Numbers", "iss", "Issue"]
+MONTHS = ["January", "February", "March", "April", "May", "June", "July", "August",
+          "September", "October", "November", "December"]
+ROMAN = ["i", "ii", "iii", "iv", "v", "vi", "vii", "viii", "ix", "x", "xi", "xii", "xiii",
+         "xiv", "xv", "xvi", "xvii", "xviii", "xix", "xx", "xxxix", "xl", "xlvi", "lxx"]
+SEPARATORS = [" ", " ", " ", "_", " - ", ", "]
+EXTENSIONS = [".pdf", ".pdf", ".pdf", ".djvu", ".epub"]
+NOISE = ["scan", "(ocr)", "[complete]", "copy", "final", "archive.org"]
+
+
+def parse_scale(value: str):
+    """Parses scale given either as 10k, 100k, 1M or as plain number of files"""
+
+    if value in SCALES:
+        return SCALES[value]
+
+    try:
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"invalid scale '{value}', expected one of {', '.join(SCALES)} or a number")
+
+
+def month_part(rng: random.Random):
+    """Returns single month or month range in one of the common spellings"""
+
+    first = rng.randrange(12)
+    name = MONTHS[first] if rng.random() < 0.5 else MONTHS[first][:3].lower()
+    if rng.random() < 0.7:
+        return name
+
+    last = rng.randrange(first, 12)
+    second = MONTHS[last] if rng.random() < 0.5 else MONTHS[last][:3].lower()
+    return f"{name}{rng.choice(['-', ' to ', ' - ', ':'])}{second}"
+
+
+def number_part(rng: random.Random):
+    """Returns issue number, number range or list of numbers"""
+
+    word = rng.choice(NUMBER_WORDS)
+    first = rng.randint(1, 12)
+    kind = rng.random()
+    if kind < 0.6:
+        return f"{word} {first}"
+    if kind < 0.8:
+        return f"{word} {first}-{rng.randint(first, 12)}"
+
+    count = rng.randint(2, 4)
+    return f"{word} {','.join(str(first + i) for i in range(count))}"
+
+
+def file_name(rng: random.Random):
+    """Returns one synthetic file name"""
+
+    year = rng.randint(1880, 1999)
+    parts = [rng.choice(TITLES)]
+
+    volume = rng.randint(1, 120)
+    volume_text = ROMAN[volume % len(ROMAN)] if rng.random() < 0.2 else str(volume)
+    parts.append(f"{rng.choice(VOLUME_WORDS)} {volume_text}")
+
+    if rng.random() < 0.75:
+        parts.append(number_part(rng))
+
+    kind = rng.random()
+    if kind < 0.5:
+        parts.append(month_part(rng))
+        parts.append(str(year))
+    elif kind < 0.7:
+        parts.append(f"{year}-{rng.randint(1, 12):02d}")
+    elif kind < 0.9:
+        parts.append(f"({year})")
+
+    if rng.random() < 0.1:
+        parts.append(rng.choice(NOISE))
+
+    return rng.choice(SEPARATORS).join(parts) + rng.choice(EXTENSIONS)
+
+
+def generate_names(count: int, seed: int = 0):
+    """
+    Generates file names. Same seed always yields the same names.
+
+    Args:
+        count (int): number of file names
+        seed (int): random seed
+
+    Returns:
+        Generator of file names
+    """
+
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield file_name(rng)
+
+
+def create_tree(root: str, names, files_per_dir: int = FILES_PER_DIR):
+    """
+    Creates empty files with given names, files_per_dir files in each directory.
+    Duplicate names within directory are created only once.
+
+    Args:
+        root (str): directory in which directories are created
+        names: iterable of file names
+        files_per_dir (int): number of files in each directory
+
+    Returns:
+        list: (dir_name, file_name) tuples of created files
+    """
+
+    entries = []
+    dir_name = None
+    existing = set()
+    for i, name in enumerate(names):
+        if i % files_per_dir == 0:
+            dir_name = os.path.join(root, f"dir{i // files_per_dir:05d}")
+            os.makedirs(dir_name)
+            existing = set()
+        if name in existing:
+            continue
+
+        existing.add(name)
+        with open(os.path.join(dir_name, name), 'w', encoding='utf-8'):
+            pass
+        entries.append((dir_name, name))
+
+    return entries
+
+
+def main():
+    """The main function"""
+
+    parser = argparse.ArgumentParser(description='synthetic file name corpus generator')
+    parser.add_argument('-n', '--scale', type=parse_scale, default='10k',
+                        help=f"Number of file names, one of {', '.join(SCALES)} or a number (default: 10k)")
+    parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+    parser.add_argument('--tree', type=str, default=None,
+                        help='Create empty files in this directory instead of printing names')
+    parser.add_argument('--files-per-dir', type=int, default=FILES_PER_DIR,
+                        help=f'Number of files in each directory of tree (default: {FILES_PER_DIR})')
+    args = parser.parse_args()
+
+    names = generate_names(args.scale, args.seed)
+    if args.tree is None:
+        for name in names:
+            sys.stdout.write(f"{name}\n")
+    else:
+        entries = create_tree(args.tree, names, args.files_per_dir)
+        print(f":: Created {len(entries)} files in {args.tree}")
+
+
+if __name__ == "__main__":
+    main()
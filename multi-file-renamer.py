@@ -1,38 +1,194 @@
 """Rename multiple files"""
 
+from __future__ import annotations
+
 import argparse
-import asyncio
+import ctypes
+import ctypes.util
+import datetime
+import errno
+import hashlib
+import inspect
 import json
+import math
 import os
-import random
 import re
+import select
+import signal
+import socket
+import socketserver
+import sqlite3
+import struct
 import sys
-from queue import Queue
-from typing import Any, Dict, List
-
-import spacy
-import yaml
-from dateutil import parser
-from jinja2 import Environment, FileSystemLoader, TemplateNotFound
-from spacy.language import Language
-from spacy.matcher import Matcher
-from spacy.tokens import Doc, Span, DocBin
-from spacy.util import filter_spans
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+from functools import lru_cache, partial
+from itertools import groupby, islice
+from typing import TYPE_CHECKING, Any, Callable, Dict, List
+
+# spacy, jinja2, yaml and dateutil are slow to import, they are imported by
+# the functions using them so that commands not needing them start quickly
+if TYPE_CHECKING:
+    from spacy.language import Language
+    from spacy.tokens import Doc, Span
 
 TRAIN_DATA_PATH = 'train_data.spacy'
 TRAIN_DATA_DEV_PATH = 'train_data_dev.spacy'
 DETAILS_PATH = 'details.json'
+EVALUATION_PATH = 'evaluation.json'
+TITLE_PAGES_PATH = 'title_pages.json'
 PATTERNS_PATH = 'patterns.yaml'
 FILE_NAMES_PATH = 'file_names.json'
 RESTORE_PATH = 'restore_data.json'
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+                         'multi-file-renamer')
+SOCKET_PATH = os.path.join(os.environ.get('XDG_RUNTIME_DIR', '/tmp'),
+                           f'multi-file-renamer-{os.getuid()}.sock')
+PATTERN_CACHE_VERSION = 2
+RESULT_CACHE_VERSION = 2
+RESULT_CACHE_CHUNK_SIZE = 500
+OCR_CACHE_VERSION = 1
+OCR_CACHE_PATH = os.path.join(CACHE_DIR, 'ocr.sqlite')
+HASH_CHUNK_SIZE = 1 << 20
+JOURNAL_COMMIT_SIZE = 256
+JOURNAL_COMMIT_INTERVAL = 1.0
+DEBOUNCE_MAX_FACTOR = 10
+
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+INOTIFY_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+AT_FDCWD = -100
+RENAME_NOREPLACE = 1
+BATCH_SIZE = 1000
+SHARD_SIZE = 10000
+LATENCY_SAMPLES = 1000
+OCR_DPI = 100
+OCR_MODEL = 'en_core_web_sm'
+HANDLER_MEMO_SIZE = 4096
+MONTH_NAMES = ['january', 'february', 'march', 'april', 'may', 'june', 'july', 'august',
+               'september', 'october', 'november', 'december']
+# month tokens understood by dateutil, these are formatted without parsing
+MONTH_NUMBERS = {**{name: i + 1 for i, name in enumerate(MONTH_NAMES)},
+                 **{name[:3]: i + 1 for i, name in enumerate(MONTH_NAMES)},
+                 'sept': 9}
+MONTH_FORMATS = {'%B', '%b', '%m'}
+FAST_CACHE_SIZE = 100000
+FAST_QUANTIFIERS = {'?': (0, 1), '*': (0, None), '+': (1, None)}
+# token attributes supported by fast engine, as defined by spacy lexeme attributes
+FAST_ATTRIBUTES = {
+    'ORTH': lambda text: text,
+    'TEXT': lambda text: text,
+    'LOWER': str.lower,
+    'LENGTH': len,
+    'IS_ALPHA': str.isalpha,
+    'IS_ASCII': str.isascii,
+    'IS_DIGIT': str.isdigit,
+    'IS_LOWER': str.islower,
+    'IS_UPPER': str.isupper,
+    'IS_TITLE': str.istitle,
+    'IS_SPACE': str.isspace,
+}
+FAST_COMPARISONS = {
+    '==': lambda v, a: v == a,
+    '!=': lambda v, a: v != a,
+    '>=': lambda v, a: v >= a,
+    '<=': lambda v, a: v <= a,
+    '>': lambda v, a: v > a,
+    '<': lambda v, a: v < a,
+}
+TITLE_PAGE_RE = re.compile(
+    r'.*Vol\s+(?P<volume>[^\s]*)\s+Nos?\s+(?P<nos>(?:(?:\s*and\s*)?(?:\d+))+)\s*(?P<date>.*)')
+SIMPLE_TEMPLATE_RE = re.compile(r'\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*\}\}')
+JINJA_CONSTANTS = {'true', 'false', 'none', 'True', 'False', 'None'}
 
 nlp_data = {
     "nlp": None,
     "matcher": None,
-    "patterns": {}
+    "patterns": {},
+    "templates": {},
+    "rules": {},
+    "prefilters": {},
+}
+
+worker_data = {
+    "args": None,
+    "nlp": None,
+    "strips": None,
+    "cache": None,
+    "dedupe": None,
+}
+
+counters = Counter()
+
+handler_memos = {}
+
+stats_data = {
+    "enabled": False,
 }
 
 
+class Timer:
+    """Context manager adding time spent in block to counters["time.<stage>"] if stats are enabled"""
+
+    def __init__(self, stage: str):
+        self.key = f"time.{stage}"
+        self.start = None
+
+    def __enter__(self):
+        if stats_data["enabled"]:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.start is not None:
+            counters[self.key] += time.perf_counter() - self.start
+
+
+def timed_generator(items, stage: str):
+    """Yields items, time spent producing each of them is added to stage timer"""
+
+    key = f"time.{stage}"
+    items = iter(items)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(items)
+        except StopIteration:
+            counters[key] += time.perf_counter() - start
+            return
+        counters[key] += time.perf_counter() - start
+        yield item
+
+
+def instrument_handler(name: str, handler: Callable):
+    """Wraps handler counting its calls and time spent in it"""
+
+    calls_key = f"handler.{name}"
+    time_key = f"time.handler.{name}"
+
+    def instrumented(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return handler(*args, **kwargs)
+        finally:
+            counters[time_key] += time.perf_counter() - start
+            counters[calls_key] += 1
+
+    return instrumented
+
+
 def get_actual_value(span: Span):
     """
     Get value for the span for use during file renaming
@@ -44,17 +200,13 @@ def get_actual_value(span: Span):
         dict: The calculated value of the field(s) as per the configured pattern
     """
 
-    if span.label_ not in nlp_data["patterns"]:
+    rule = nlp_data["rules"].get(span.label_)
+    if rule is None:
         return {}
 
-    input_rules = nlp_data["patterns"][span.label_].get("input", {})
-    output_rules = nlp_data["patterns"][span.label_].get("output", {})
-
-    value = get_input_value(span, input_rules)
-    return process_output(value, output_rules)
+    return rule(span)
 
 
-@Language.component("rename_pipe")
 def rename_pipe_entity(doc: Doc):
     """
     Add matched entities to the document. This function is used in spacy pipeline.
@@ -66,6 +218,13 @@ def rename_pipe_entity(doc: Doc):
         Doc: doc object returned for use in pipeline
     """
 
+    from spacy.tokens import Span
+    from spacy.util import filter_spans
+
+    enabled = stats_data["enabled"]
+    if enabled:
+        start_time = time.perf_counter()
+
     matches = nlp_data["matcher"](doc)
 
     ents = []
@@ -73,34 +232,182 @@ def rename_pipe_entity(doc: Doc):
         ents.append(
             Span(doc, start, end, label=nlp_data["nlp"].vocab.strings[match_id]))
 
+    if enabled:
+        match_time = time.perf_counter()
+        counters["time.pipeline.matcher"] += match_time - start_time
+
     doc.ents = filter_spans(ents)
 
+    if enabled:
+        counters["time.pipeline.filter_spans"] += time.perf_counter() - match_time
+
     return doc
 
 
-def load_patterns(file_path: str):
+def register_rename_pipe():
+    """Registers rename_pipe component with spacy"""
+
+    from spacy.language import Language
+
+    if not Language.has_factory("rename_pipe"):
+        Language.component("rename_pipe", func=rename_pipe_entity)
+
+
+def get_file_hash(file_path: str):
+    """Returns sha256 hex digest of file content or None if file can not be read"""
+
+    digest = hashlib.sha256()
+    try:
+        with open(file_path, 'rb') as f:
+            for chunk in iter(partial(f.read, HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+    except OSError:
+        return None
+
+    return digest.hexdigest()
+
+
+def get_pattern_search_path(file_path: str):
+    """Returns directories searched by jinja for patterns file and templates it includes"""
+
+    return [os.path.dirname(file_path) or '.', '.']
+
+
+def get_pattern_cache_path(file_path: str):
+    """
+    Get path of cached rendered patterns for given patterns file.
+    Cache key is derived from file content, template search path, spacy version and
+    cache format version. Templates included by patterns file are checked by read_pattern_cache.
+
+    Args:
+        file_path (str): file path to load patterns from
+
+    Returns:
+        str: cache file path or None if patterns file can not be read
+    """
+
+    import spacy
+
+    file_hash = get_file_hash(file_path)
+    if file_hash is None:
+        return None
+
+    search_path = [os.path.abspath(path) for path in get_pattern_search_path(file_path)]
+    key = hashlib.sha256(
+        f"{file_hash}:{search_path}:{spacy.__version__}:{PATTERN_CACHE_VERSION}".encode())
+
+    return os.path.join(CACHE_DIR, 'patterns', f"{key.hexdigest()}.json")
+
+
+def read_pattern_cache(cache_path: str):
+    """
+    Reads cached rendered patterns, returns None if cache is missing or invalid, or if any
+    of the templates used to render the patterns has changed since they were cached.
+    """
+
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        templates = cached["templates"]
+        for path, file_hash in templates.items():
+            if get_file_hash(path) != file_hash:
+                return None
+        return cached["patterns"], templates
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+
+def write_pattern_cache(cache_path: str, patterns, templates: Dict[str, str]):
+    """
+    Writes rendered patterns and hashes of templates used to render them to cache,
+    errors are ignored as cache is optional
+    """
+
+    try:
+        data = json.dumps({"templates": templates, "patterns": patterns})
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(temp_path, cache_path)
+    except (OSError, TypeError, ValueError):
+        pass
+
+
+def render_patterns(file_path: str):
+    """
+    Renders patterns file using jinja and records every template loaded while rendering,
+    i.e. the patterns file and the files it includes or imports.
+
+    Args:
+        file_path (str): file path to load patterns from
+
+    Returns:
+        tuple: (yaml_string, templates) tuple, templates maps absolute path of every
+               loaded template to sha256 hex digest of its content
+    """
+
+    from jinja2 import Environment, FileSystemLoader
+
+    loader = FileSystemLoader(get_pattern_search_path(file_path))
+    templates = {}
+    get_source = loader.get_source
+
+    def recording_get_source(environment, template):
+        source, path, uptodate = get_source(environment, template)
+        templates[os.path.abspath(path)] = hashlib.sha256(source.encode(loader.encoding)).hexdigest()
+        return source, path, uptodate
+
+    loader.get_source = recording_get_source
+    env = Environment(loader=loader)
+    yaml_string = env.get_template(os.path.basename(file_path)).render({})
+
+    return yaml_string, templates
+
+
+def load_patterns(file_path: str, use_cache: bool = True):
     """
     Loads patterns.yaml or equivalent file.
+    Rendered patterns are cached on disk and reused while patterns file and templates
+    it includes are unchanged.
 
     Args:
         file_path (str): file path to load patterns from
+        use_cache (bool): use on disk cache of rendered patterns
 
     Returns:
         None
     """
 
-    try:
-        env = Environment(loader=FileSystemLoader('.'))
-        template = env.get_template(file_path)
-        yaml_string = template.render({})
+    cache_path = get_pattern_cache_path(file_path) if use_cache else None
+    cached = read_pattern_cache(cache_path) if cache_path is not None else None
 
-        nlp_data["patterns"] = yaml.safe_load(yaml_string)
-    except (TemplateNotFound, yaml.YAMLError, spacy.errors.MatchPatternError) as e:
-        print(f"Error while reading patterns: {e}")
-        sys.exit(1)
+    if cached is None:
+        import spacy
+        import yaml
+        from jinja2 import TemplateNotFound
+
+        try:
+            yaml_string, templates = render_patterns(file_path)
+
+            patterns = yaml.safe_load(yaml_string)
+        except (TemplateNotFound, yaml.YAMLError, spacy.errors.MatchPatternError) as e:
+            print(f"Error while reading patterns: {e}")
+            sys.exit(1)
+
+        if cache_path is not None:
+            write_pattern_cache(cache_path, patterns, templates)
+    else:
+        patterns, templates = cached
+
+    nlp_data["patterns"] = patterns
+    nlp_data["templates"] = templates
+
+    nlp_data["rules"] = compile_patterns(nlp_data["patterns"])
+    nlp_data["prefilters"] = {}
 
 
-def get_matcher(nlp, file_path: str):
+def get_matcher(nlp, file_path: str, use_cache: bool = True):
     """
     Get matcher for use in spacy pipeline.
     Matcher is using patterns defined in file_path.
@@ -108,477 +415,3214 @@ def get_matcher(nlp, file_path: str):
     Args:
         nlp: Spacy nlp object
         file_path (str): the file path to load patterns from
+        use_cache (bool): use on disk cache of rendered patterns
 
     Returns:
         Matcher: matcher object
     """
 
+    import spacy
+    from spacy.matcher import Matcher
+
     matcher = Matcher(nlp.vocab)
 
-    load_patterns(file_path)
+    load_patterns(file_path, use_cache)
 
-    for key, data in nlp_data["patterns"].items():
-        matcher.add(key, data["patterns"])
+    try:
+        for key, data in nlp_data["patterns"].items():
+            matcher.add(key, data["patterns"])
+    except (spacy.errors.MatchPatternError, KeyError, TypeError, ValueError) as e:
+        print(f"Error while reading patterns: {e}")
+        sys.exit(1)
 
     return matcher
 
 
-def nlp_init(file_path: str):
+def nlp_init(file_path: str, use_cache: bool = True):
     """
     Initializes nlp_data global object
 
     Args:
         file_path (str): file path to load patterns from
+        use_cache (bool): use on disk cache of rendered patterns
 
     Returns:
         None
     """
 
+    import spacy
+    from spacy.tokens import Span
+
+    register_rename_pipe()
     nlp_data["nlp"] = nlp = spacy.blank("en")
-    nlp_data["matcher"] = get_matcher(nlp, file_path)
+    nlp_data["matcher"] = get_matcher(nlp, file_path, use_cache)
     nlp.add_pipe("rename_pipe", last=True)
 
-    Span.set_extension("actual_value", getter=get_actual_value)
+    Span.set_extension("actual_value", getter=get_actual_value, force=True)
     # print(f'Prefixes: {nlp.Defaults.prefixes}, Suffixes: {nlp.Defaults.suffixes}, Infixes: {nlp.Defaults.infixes}')
 
 
-def get_input_value(span: Span, input_rules):
+class FastToken:
+    """Token of fast engine document, provides the attributes used by input rules"""
+
+    __slots__ = ('text',)
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FastSpan:
+    """Entity of fast engine document, provides the attributes of spacy Span used by rules"""
+
+    __slots__ = ('doc', 'start', 'end', 'label_')
+
+    def __init__(self, doc, start: int, end: int, label_: str):
+        self.doc = doc
+        self.start = start
+        self.end = end
+        self.label_ = label_
+
+    @property
+    def text(self):
+        texts = self.doc.texts
+        spaces = self.doc.spaces
+        return ''.join(texts[i] + (' ' if i in spaces else '')
+                       for i in range(self.start, self.end - 1)) + texts[self.end - 1]
+
+
+class FastDoc:
+    """Document produced by fast engine, tokens are created only when rules access them"""
+
+    __slots__ = ('texts', 'spaces', 'ents')
+
+    def __init__(self, texts: List[str], spaces):
+        self.texts = texts
+        self.spaces = spaces
+        self.ents = []
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [FastToken(text) for text in self.texts[index]]
+        return FastToken(self.texts[index])
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __iter__(self):
+        return (FastToken(text) for text in self.texts)
+
+
+def compile_fast_value(value, name: str, errors: List[str]):
+    """
+    Compile value of a token pattern attribute into a predicate on attribute value.
+
+    Args:
+        value: value from token pattern, either literal or dict of operators
+        name (str): name of pattern being compiled, used in error messages
+        errors (List[str]): list to which compilation errors are appended
+
+    Returns:
+        Callable: function accepting attribute value and returning bool
+    """
+
+    if not isinstance(value, dict):
+        return lambda v: v == value
+
+    checks = []
+    for operator, argument in value.items():
+        if operator == "IN":
+            members = set(argument)
+            checks.append(lambda v, members=members: v in members)
+        elif operator == "NOT_IN":
+            members = set(argument)
+            checks.append(lambda v, members=members: v not in members)
+        elif operator == "REGEX":
+            regex = re.compile(argument)
+            checks.append(lambda v, regex=regex: isinstance(v, str) and regex.search(v) is not None)
+        elif operator in FAST_COMPARISONS:
+            compare = FAST_COMPARISONS[operator]
+            checks.append(lambda v, compare=compare, argument=argument: compare(v, argument))
+        else:
+            errors.append(f"{name}: operator {operator} is not supported by fast engine")
+
+    if len(checks) == 1:
+        return checks[0]
+
+    return lambda v: all(check(v) for check in checks)
+
+
+def compile_fast_token(spec: Dict[str, Any], name: str, errors: List[str]):
+    """
+    Compile token pattern into predicate on token text.
+
+    Args:
+        spec (dict): token pattern, for example {"LOWER": {"IN": ["vol"]}, "OP": "?"}
+        name (str): name of pattern being compiled, used in error messages
+        errors (List[str]): list to which compilation errors are appended
+
+    Returns:
+        tuple: (predicate, min_count, max_count) tuple, max_count is None if unlimited
+    """
+
+    if not isinstance(spec, dict):
+        errors.append(f"{name}: token pattern must be a mapping")
+        return None
+
+    checks = []
+    op = None
+    for attr, value in spec.items():
+        attr = attr.upper()
+        if attr == "OP":
+            op = value
+            continue
+        if attr not in FAST_ATTRIBUTES:
+            errors.append(f"{name}: attribute {attr} is not supported by fast engine")
+            continue
+        checks.append((FAST_ATTRIBUTES[attr], compile_fast_value(value, name, errors)))
+
+    if len(checks) == 1:
+        get, check = checks[0]
+
+        def predicate(text):
+            return check(get(text))
+    else:
+        def predicate(text):
+            return all(check(get(text)) for get, check in checks)
+
+    if op is None:
+        return predicate, 1, 1
+    if op == "!":
+        return (lambda text: not predicate(text)), 1, 1
+    if op in FAST_QUANTIFIERS:
+        return (predicate, *FAST_QUANTIFIERS[op])
+
+    quantifier = re.fullmatch(r'\{(\d*)(,?)(\d*)\}', str(op))
+    if quantifier is None or (not quantifier.group(2) and not quantifier.group(1)):
+        errors.append(f"{name}: operator {op} is not supported by fast engine")
+        return None
+
+    low = int(quantifier.group(1) or 0)
+    if not quantifier.group(2):
+        return predicate, low, low
+
+    return predicate, low, int(quantifier.group(3)) if quantifier.group(3) else None
+
+
+class FastEngine:
+    """
+    Rule only replacement of spacy pipeline. Token patterns are compiled into a trie of
+    token predicates which is evaluated in pure python over tokens of preprocessed file
+    names. Like spacy Matcher every possible length of optional and repeated tokens is a
+    match, and matches are filtered like spacy filter_spans. File names where patterns of
+    different labels match the very same tokens are rare, their matches are ordered by
+    spacy Matcher.
+    """
+
+    def __init__(self, patterns: Dict[str, Any]):
+        errors = []
+        self.predicates = []
+        self.labels = []
+        # trie node is (children, ends) tuple, children maps step to child node and
+        # ends lists indexes of patterns ending in the node
+        self.root = ({}, [])
+        predicate_ids = {}
+
+        for label, data in patterns.items():
+            for i, pattern in enumerate(data.get("patterns", [])):
+                name = f"{label}.patterns[{i}]"
+                if not pattern:
+                    errors.append(f"{name}: pattern is empty")
+                    continue
+
+                node = self.root
+                for spec in pattern:
+                    step = compile_fast_token(spec, name, errors)
+                    if step is None:
+                        continue
+                    # identical token patterns share predicate, so it is evaluated once per token
+                    key = json.dumps(spec, sort_keys=True, default=str)
+                    if key not in predicate_ids:
+                        predicate_ids[key] = len(self.predicates)
+                        self.predicates.append(step[0])
+                    node = node[0].setdefault((predicate_ids[key], step[1], step[2]), ({}, []))
+                node[1].append(len(self.labels))
+                self.labels.append(label)
+
+        if errors:
+            for error in errors:
+                print(f":: {error}")
+            print(":: Use --engine spacy for these patterns")
+            sys.exit(1)
+
+        import spacy
+
+        # tokenizer is only used once for every distinct whitespace separated chunk
+        self.tokenizer = spacy.blank("en").tokenizer
+        self.chunks = {}
+        self.patterns = patterns
+        self.matcher = None
+
+    def split(self, chunk: str):
+        """
+        Splits whitespace separated chunk into tokens the same way spacy tokenizer does.
+
+        Returns:
+            tuple: ((text, predicates), ...) tuple, predicates holds indexes of predicates
+                   true for the token
+        """
+
+        if len(self.chunks) >= FAST_CACHE_SIZE:
+            self.chunks.clear()
+
+        tokens = tuple((t.text, tuple(i for i, p in enumerate(self.predicates) if p(t.text)))
+                       for t in self.tokenizer(chunk))
+        self.chunks[chunk] = tokens
+        return tokens
+
+    def spacy_matches(self, text: str):
+        """Returns (label, start, end) tuples of matches found by spacy Matcher, in its order"""
+
+        if self.matcher is None:
+            from spacy.matcher import Matcher
+
+            self.matcher = Matcher(self.tokenizer.vocab)
+            for label, data in self.patterns.items():
+                self.matcher.add(label, data["patterns"])
+
+        strings = self.tokenizer.vocab.strings
+        return [(strings[match_id], start, end)
+                for match_id, start, end in self.matcher(self.tokenizer(text))]
+
+    def match(self, masks, length: int):
+        """
+        Returns (pattern_index, start, end) tuples of all the matches. Sets of token
+        positions are int bit masks, bit i of masks[predicate] is set if token i satisfies
+        the predicate.
+        """
+
+        matches = []
+        first_steps = self.root[0]
+        if any(low == 0 for _, low, _ in first_steps):
+            starts = range(length)
+        else:
+            # only tokens matching first token of some pattern can start a match
+            first_tokens = 0
+            for predicate, _, _ in first_steps:
+                first_tokens |= masks[predicate]
+            starts = [i for i in range(length) if first_tokens >> i & 1]
+
+        for start in starts:
+            pending = [(self.root, 1 << start)]
+            while pending:
+                (children, _), positions = pending.pop()
+                for (predicate, low, high), child in children.items():
+                    mask = masks[predicate]
+                    if low == 1 and high == 1:
+                        next_positions = (positions & mask) << 1
+                    else:
+                        next_positions = positions if low == 0 else 0
+                        current = positions
+                        count = 0
+                        while current and count != high:
+                            current = (current & mask) << 1
+                            count += 1
+                            if count >= low:
+                                next_positions |= current
+
+                    if not next_positions:
+                        continue
+                    if child[1]:
+                        ends = next_positions >> (start + 1)
+                        end = start + 1
+                        while ends:
+                            if ends & 1:
+                                matches.extend((pattern, start, end) for pattern in child[1])
+                            ends >>= 1
+                            end += 1
+                    if child[0]:
+                        pending.append((child, next_positions))
+
+        return matches
+
+    def __call__(self, text: str):
+        enabled = stats_data["enabled"]
+        if enabled:
+            start_time = time.perf_counter()
+
+        texts = []
+        masks = [0] * len(self.predicates)
+        spaces = set()
+        chunks = self.chunks
+        for i, chunk in enumerate(text.split(' ') if text else ()):
+            if not chunk:
+                if i > 0:
+                    continue
+                # like spacy, leading space is a token on its own
+                chunk = ' '
+            tokens = chunks.get(chunk)
+            if tokens is None:
+                tokens = self.split(chunk)
+            for token_text, predicates in tokens:
+                bit = 1 << len(texts)
+                for predicate in predicates:
+                    masks[predicate] |= bit
+                texts.append(token_text)
+            if chunk != ' ':
+                spaces.add(len(texts) - 1)
+        spaces.discard(len(texts) - 1)
+        doc = FastDoc(texts, spaces)
+
+        if enabled:
+            match_time = time.perf_counter()
+            counters["time.pipeline.tokenizer"] += match_time - start_time
+
+        matches = self.match(masks, len(texts))
+
+        if enabled:
+            filter_time = time.perf_counter()
+            counters["time.pipeline.matcher"] += filter_time - match_time
+
+        spans = {}
+        ambiguous = False
+        for pattern, start, end in matches:
+            label = self.labels[pattern]
+            if spans.setdefault((start, end), label) != label:
+                ambiguous = True
+
+        if ambiguous:
+            # filter_spans keeps the first of spans with the same start and end, the order
+            # of such matches depends on internals of spacy Matcher, so it is asked instead
+            counters["fast_engine_fallbacks"] += 1
+            candidates = list(dict.fromkeys(self.spacy_matches(text)))
+        else:
+            candidates = [(label, start, end) for (start, end), label in spans.items()]
+
+        # same as spacy filter_spans
+        candidates.sort(key=lambda m: (m[2] - m[1], -m[1]), reverse=True)
+        ents = []
+        seen_tokens = set()
+        for label, start, end in candidates:
+            if start not in seen_tokens and end - 1 not in seen_tokens:
+                ents.append(FastSpan(doc, start, end, label))
+                seen_tokens.update(range(start, end))
+        ents.sort(key=lambda span: span.start)
+        doc.ents = ents
+
+        if enabled:
+            counters["time.pipeline.filter_spans"] += time.perf_counter() - filter_time
+
+        return doc
+
+    def pipe(self, texts, batch_size: int = BATCH_SIZE):
+        """Yields documents for texts, same interface as spacy Language.pipe"""
+
+        for text in texts:
+            yield self(text)
+
+
+def fast_init(file_path: str, use_cache: bool = True):
+    """
+    Initializes nlp_data global object with fast engine instead of spacy pipeline
+
+    Args:
+        file_path (str): file path to load patterns from
+        use_cache (bool): use on disk cache of rendered patterns
+
+    Returns:
+        None
+    """
+
+    load_patterns(file_path, use_cache)
+    nlp_data["nlp"] = FastEngine(nlp_data["patterns"])
+    nlp_data["matcher"] = None
+
+
+def convert_roman_nums_handler(value: str):
+    if value.isnumeric():
+        return value
+
+    return str(roman_to_int(value.upper()))
+
+
+def date_handler(value: str, format: str):
+    month = MONTH_NUMBERS.get(value.lower())
+    if month is not None and format in MONTH_FORMATS:
+        return datetime.date(2000, month, 1).strftime(format)
+
+    from dateutil import parser
+
+    try:
+        p = parser.parse(value)
+        return p.strftime(format)
+    except parser.ParserError as e:
+        print(f":: Invalid date '{value}': {e}")
+        sys.exit(1)
+
+
+def joiner_handler(values: List[Any], separator: str,
+                   exclusions: List[Any] = None, outputs: List[Callable] = None):
+    if outputs is None:
+        values = [v for v in values if exclusions is None or v not in exclusions]
+        return separator.join(map(str, values))
+
+    if len(values) != len(outputs):
+        print(":: multi output handling: count of values and outputs do not match")
+        sys.exit(1)
+
+    return separator.join([outputs[i](values[i]) for i in range(len(values))])
+
+
+HANDLERS = {
+    "convert_roman_nums": convert_roman_nums_handler,
+    "date": date_handler,
+    "joiner": joiner_handler,
+}
+
+
+def memoize_handler(handler: str, args: Dict[str, Any], function: Callable):
+    """
+    Memoizes handler results. Handlers depend only on the value and rule arguments,
+    so results are shared by all rules using the same handler with the same arguments.
+
+    Args:
+        handler (str): handler name
+        args (dict): handler arguments as written in patterns file
+        function (Callable): handler with arguments bound, accepting value
+
+    Returns:
+        Callable: memoized function accepting value
+    """
+
+    key = (handler, json.dumps(args, sort_keys=True, default=str))
+    if key in handler_memos:
+        return handler_memos[key]
+
+    misses_key = f"memo_miss.{handler}"
+
+    @lru_cache(maxsize=HANDLER_MEMO_SIZE)
+    def cached(value):
+        counters[misses_key] += 1
+        return function(list(value) if isinstance(value, tuple) else value)
+
+    def memoized(value):
+        return cached(tuple(value) if isinstance(value, list) else value)
+
+    handler_memos[key] = memoized
+    return memoized
+
+
+def compile_index(index, name: str, errors: List[str]):
+    """
+    Compile an index of input rules into a function returning absolute token index.
+
+    Args:
+        index: an int or keyword "start" or "end"
+        name (str): name of rule being compiled, used in error messages
+        errors (List[str]): list to which compilation errors are appended
+
+    Returns:
+        Callable: function accepting span and returning absolute token index
+    """
+
+    if index == "start":
+        return lambda span: span.start
+    if index == "end":
+        return lambda span: span.end - 1
+    if not isinstance(index, int):
+        errors.append(f"{name}: index keyword {index} is not supported")
+        return None
+    if index < 0:
+        return lambda span: span.end + index
+
+    return lambda span: span.start + index
+
+
+def compile_input(input_rules, name: str, errors: List[str]):
     """
-    Get value from given span using specified input rules.
+    Compile input rules into a function returning value from given span.
 
     Args:
-        span (Span): Spacy Span object
         input_rules (dict): A dict object containing input rules.
                             Expected keys are:
-                            - "type" (one of "single", "all", "distinct" or "multi") 
+                            - "type" (one of "single", "all", "distinct" or "multi")
+        name (str): name of rule being compiled, used in error messages
+        errors (List[str]): list to which compilation errors are appended
 
     Returns:
-        object
+        Callable: function accepting span and returning object
     """
 
-    if "type" not in input_rules:
-        print(":: type is mandatory field for input rules")
-        sys.exit(1)
+    if not isinstance(input_rules, dict) or "type" not in input_rules:
+        errors.append(f"{name}: type is mandatory field for input rules")
+        return None
 
     input_type = input_rules["type"]
 
-    if input_type == "single":
-        if "index" not in input_rules:
-            print(":: index is mandatory field")
-            sys.exit(1)
+    if input_type == "single":
+        if "index" not in input_rules:
+            errors.append(f"{name}: index is mandatory field")
+            return None
+
+        index = input_rules["index"]
+        if index == "start":
+            return lambda span: span.doc[span.start].text
+        if index == "end":
+            return lambda span: span.doc[span.end - 1].text
+        if not isinstance(index, int):
+            errors.append(f"{name}: index is non numeric")
+            return None
+
+        return lambda span: span.doc[index].text
+
+    if input_type == "all":
+        return lambda span: span.text
+
+    if input_type == "distinct":
+        if "indexes" not in input_rules:
+            errors.append(f"{name}: indexes field is mandatory for input type distinct")
+            return None
+
+        indexes = [compile_index(index, name, errors)
+                   for index in input_rules["indexes"]]
+        return lambda span: [span.doc[index(span)].text for index in indexes]
+
+    if input_type == "multi":
+        start = input_rules.get("start", "start")
+        end = input_rules.get("end", "end")
+
+        if start != "start" and not isinstance(start, int):
+            errors.append(f"{name}: start is non numeric")
+            return None
+        if end != "end" and not isinstance(end, int):
+            errors.append(f"{name}: end is non numeric")
+            return None
+
+        start = 0 if start == "start" else start
+        if end == "end":
+            return lambda span: [t.text for t in span.doc[span.start + start:span.end]]
+
+        return lambda span: [t.text for t in span.doc[span.start + start:span.start + end]]
+
+    errors.append(f"{name}: Unsupported input type: {input_type}")
+    return None
+
+
+def compile_value(output: Dict[str, Any], name: str, errors: List[str]):
+    """
+    Compile handler of an output rule into a function converting raw value.
+
+    Args:
+        output (dict): output rule
+        name (str): name of rule being compiled, used in error messages
+        errors (List[str]): list to which compilation errors are appended
+
+    Returns:
+        Callable: function accepting value and returning converted value
+    """
+
+    if "handler" not in output:
+        return lambda value: value
+
+    handler = output["handler"]
+    if handler not in HANDLERS:
+        errors.append(f"{name}: Handler {handler} is not implemented")
+        return None
+
+    args = dict(output.get("args", {}))
+    if "outputs" in args:
+        args["outputs"] = [compile_value(o, f"{name}.outputs[{i}]", errors)
+                           for i, o in enumerate(args["outputs"])]
+
+    try:
+        inspect.signature(HANDLERS[handler]).bind(None, **args)
+    except TypeError as e:
+        errors.append(f"{name}: Invalid arguments for handler {handler}: {e}")
+        return None
+
+    function = memoize_handler(handler, output.get("args", {}), partial(HANDLERS[handler], **args))
+    if stats_data["enabled"]:
+        return instrument_handler(handler, function)
+
+    return function
+
+
+def compile_output(output: Dict[str, Any], name: str, errors: List[str]):
+    """
+    Compile output rules into a function returning dict of field values.
+
+    Args:
+        output (dict): output rules
+        name (str): name of rule being compiled, used in error messages
+        errors (List[str]): list to which compilation errors are appended
+
+    Returns:
+        Callable: function accepting value and returning dict
+    """
+
+    if not isinstance(output, dict) or "type" not in output:
+        errors.append(f"{name}: Output 'type' not specified")
+        return None
+
+    if output["type"] == "single":
+        if "index" not in output:
+            errors.append(f"{name}: index not defined for {output}")
+            return None
+
+        index = output["index"]
+        value = compile_value(output, name, errors)
+        return lambda v: {index: value(v)}
+
+    if output["type"] == "multi":
+        outputs = output.get("outputs")
+        if not isinstance(outputs, (list, tuple)):
+            errors.append(f"{name}: outputs is mandatory for multi output type")
+            return None
+
+        fields = []
+        for i, o in enumerate(outputs):
+            if "index" not in o:
+                errors.append(f"{name}.outputs[{i}]: index not defined for {o}")
+                continue
+            fields.append((o["index"], compile_value(o, f"{name}.outputs[{i}]", errors)))
+
+        def process_multi_output(values):
+            if not isinstance(values, (list, tuple)):
+                values = [values] * len(fields)
+            return {index: value(v) for (index, value), v in zip(fields, values)}
+
+        return process_multi_output
+
+    errors.append(f"{name}: Unsupported output type: {output['type']}")
+    return None
+
+
+def chain_rule(get_input: Callable, process_output: Callable):
+    """Chain compiled input and output rules into single function"""
+
+    return lambda span: process_output(get_input(span))
+
+
+def compile_patterns(patterns: Dict[str, Any]):
+    """
+    Compile input and output rules of all labels into functions.
+    All the errors are reported together and program exits if there are any.
+
+    Args:
+        patterns (dict): patterns loaded from patterns.yaml or equivalent file
+
+    Returns:
+        dict: label to function mapping, function accepts span and returns dict
+    """
+
+    errors = []
+    rules = {}
+
+    if not isinstance(patterns, dict):
+        errors.append("patterns file must contain mapping of labels")
+        patterns = {}
+
+    for label, data in patterns.items():
+        if not isinstance(data, dict):
+            errors.append(f"{label}: rules must be a mapping")
+            continue
+
+        get_input = compile_input(data.get("input", {}), f"{label}.input", errors)
+        process_output = compile_output(data.get("output", {}), f"{label}.output", errors)
+        rules[label] = chain_rule(get_input, process_output)
+
+    if errors:
+        for error in errors:
+            print(f":: {error}")
+        sys.exit(1)
+
+    return rules
+
+
+def get_token_requirement(spec: Dict[str, Any]):
+    """
+    Get condition that text must satisfy for token pattern to match any of its tokens.
+    Only ASCII literals are used, their lower case form is a substring of lower cased text.
+
+    Args:
+        spec (dict): token pattern, for example {"LOWER": {"IN": ["vol"]}}
+
+    Returns:
+        tuple: ("lower" or "text", frozenset of literals) tuple, ("digit",) tuple
+               or None if text is not restricted
+    """
+
+    for attr, value in spec.items():
+        attr = attr.upper()
+        if attr == "IS_DIGIT" and value is True:
+            return ("digit",)
+        if attr not in ("LOWER", "ORTH", "TEXT"):
+            continue
+
+        values = value.get("IN") if isinstance(value, dict) else [value]
+        if not isinstance(values, list) or not values or \
+                not all(isinstance(v, str) and v and v.isascii() for v in values):
+            continue
+
+        return ("lower", frozenset(values)) if attr == "LOWER" else ("text", frozenset(values))
+
+    return None
+
+
+def get_pattern_requirements(pattern):
+    """Get conditions on text of tokens every match of pattern must contain"""
+
+    requirements = set()
+    for spec in pattern if isinstance(pattern, list) else []:
+        if not isinstance(spec, dict):
+            continue
+
+        # only tokens matched at least once are required: no operator, "+", "{n}",
+        # "{n,m}" or "{n,}" with n >= 1
+        op = spec.get("OP")
+        quantifier = re.fullmatch(r'\{(\d+)(?:,\d*)?\}', str(op)) if op is not None else None
+        if op is not None and op != "+" and not (quantifier and int(quantifier.group(1)) > 0):
+            continue
+
+        requirement = get_token_requirement(spec)
+        if requirement is not None:
+            requirements.add(requirement)
+
+    return frozenset(requirements)
+
+
+def compile_prefilter(patterns: Dict[str, Any], mandatory: List[str]):
+    """
+    Compile check rejecting texts in which patterns can not find all mandatory fields.
+    A field can be found only if some pattern of a label producing it has all its required
+    tokens (keywords, digits) present in the text. Texts passing the check may still
+    miss fields, but rejected texts never have them.
+
+    Args:
+        patterns (dict): patterns loaded from patterns.yaml or equivalent file
+        mandatory (List[str]): mandatory fields
+
+    Returns:
+        Callable: function accepting text and returning False if it can not contain
+                  mandatory fields, or None if patterns do not restrict any field
+    """
+
+    def get_fields(output):
+        if not isinstance(output, dict):
+            return set()
+        if output.get("type") == "multi":
+            return {o.get("index") for o in output.get("outputs", []) if isinstance(o, dict)}
+        return {output.get("index")}
+
+    fields = []
+    for field in dict.fromkeys(mandatory):
+        alternatives = set()
+        for data in patterns.values():
+            if field in get_fields(data.get("output")):
+                alternatives.update(get_pattern_requirements(p) for p in data.get("patterns", []))
+        if frozenset() in alternatives:
+            continue
+        fields.append(alternatives)
+
+    if not fields:
+        return None
+
+    literals = {}
+    for requirement in {r for alternatives in fields for requirement in alternatives for r in requirement}:
+        if requirement[0] != "digit":
+            literals[requirement] = re.compile(
+                '|'.join(re.escape(v) for v in sorted(requirement[1], key=len, reverse=True)))
+
+    def check(text: str):
+        lower = text.lower()
+        found = {}
+        for alternatives in fields:
+            for requirements in alternatives:
+                for requirement in requirements:
+                    if requirement not in found:
+                        if requirement[0] == "digit":
+                            found[requirement] = any(map(str.isdigit, text))
+                        else:
+                            found[requirement] = literals[requirement].search(
+                                lower if requirement[0] == "lower" else text) is not None
+                    if not found[requirement]:
+                        break
+                else:
+                    break
+            else:
+                return False
+
+        return True
+
+    return check
+
+
+def get_prefilter(mandatory: List[str]):
+    """Returns compiled prefilter of mandatory fields for loaded patterns, see compile_prefilter"""
+
+    key = tuple(sorted(mandatory))
+    if key not in nlp_data["prefilters"]:
+        nlp_data["prefilters"][key] = compile_prefilter(nlp_data["patterns"], mandatory)
+
+    return nlp_data["prefilters"][key]
+
+
+def roman_to_int(s: str) -> int:
+    """
+    Converts a Roman numeral string to its integer equivalent.
+
+    Args:
+        s: The Roman numeral string (e.g., "IV", "IX", "MCMXCIV").
+
+    Returns:
+        The integer representation of the Roman numeral.
+    """
+    roman_values = {
+        'I': 1, 'V': 5, 'X': 10, 'L': 50,
+        'C': 100, 'D': 500, 'M': 1000
+    }
+
+    total = 0
+    for i, x in enumerate(s):
+        current_value = roman_values[x]
+
+        if i + 1 < len(s) and current_value < roman_values[s[i+1]]:
+            current_value *= -1
+
+        total += current_value
+
+    return total
+
+
+def ocr_title_page(pdf_path: str, page_number: int, dpi: int = OCR_DPI):
+    """
+    Rasterizes single page of pdf and extracts its text using tesseract.
+    This function is executed inside OCR worker process.
+
+    Args:
+        pdf_path (str): path of pdf file
+        page_number (int): page number, starting from 1
+        dpi (int): resolution of rasterized page
+
+    Returns:
+        str: text of page
+    """
+
+    import pytesseract
+    from pdf2image import convert_from_path
+
+    images = convert_from_path(
+        pdf_path, first_page=page_number, last_page=page_number, dpi=dpi)
+    if not images:
+        raise ValueError(f"could not rasterize page {page_number}")
+
+    return pytesseract.image_to_string(images[0])
+
+
+def parse_title_page(text: str, page_number: int):
+    """
+    Finds volume and issue numbers in text of title page
+
+    Args:
+        text (str): text of title page
+        page_number (int): page number
+
+    Returns:
+        tuple: (result, dates) tuple, dates are texts following matched issue numbers
+               that still need to be parsed by spacy
+    """
+
+    result = {
+        'page': page_number,
+    }
+    dates = []
+    for t in text.split('\n'):
+        res = TITLE_PAGE_RE.search(t)
+        if res:
+            result['match'] = t
+            result['volume'] = roman_to_int(
+                res.group('volume').upper()) if res.group('volume') is not None else 0
+            result['nos'] = [int(i)
+                             for i in re.findall(r'(\d+)', res.group('nos'))]
+            dates.append(res.group('date'))
+
+    return result, dates
+
+
+def add_title_page_dates(nlp: Language, parsed):
+    """
+    Parses dates of a batch of title pages with batched spacy pipeline
+
+    Args:
+        nlp (Language): spacy nlp object with NER
+        parsed: list of (result, dates) tuples returned by parse_title_page
+
+    Returns:
+        list: results with 'date' set to the last DATE entity found
+    """
+
+    texts = [date for _, dates in parsed for date in dates]
+    docs = iter(nlp.pipe(texts))
+    for result, dates in parsed:
+        for _ in dates:
+            for e in next(docs).ents:
+                if e.label_ == "DATE":
+                    result['date'] = e.text
+
+    return [result for result, _ in parsed]
+
+
+def get_title_page_details(pdf_path, page_number, nlp, dpi: int = OCR_DPI):
+    """Extracts volume, issue numbers and date from title page of pdf"""
+
+    return add_title_page_dates(nlp, [parse_title_page(ocr_title_page(pdf_path, page_number, dpi),
+                                                       page_number)])[0]
+
+
+class OcrCache:
+    """
+    Persistent cache of OCR text of pdf pages stored in SQLite database.
+    Pages are identified by content hash of pdf, so renamed or moved files are still found.
+    """
+
+    def __init__(self, path: str, tesseract_version: str):
+        """
+        Opens OCR cache
+
+        Args:
+            path (str): path of SQLite database
+            tesseract_version (str): version of tesseract, text OCRed by other versions is not used
+        """
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.tesseract_version = f"{OCR_CACHE_VERSION}:{tesseract_version}"
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS pages (
+            pdf_hash TEXT NOT NULL,
+            page INTEGER NOT NULL,
+            dpi INTEGER NOT NULL,
+            tesseract TEXT NOT NULL,
+            text TEXT NOT NULL,
+            PRIMARY KEY (pdf_hash, page, dpi, tesseract))""")
+
+    def get(self, pdf_hash: str, page_number: int, dpi: int):
+        """Returns cached text of page or None"""
+
+        row = self.connection.execute(
+            "SELECT text FROM pages WHERE pdf_hash = ? AND page = ? AND dpi = ? AND tesseract = ?",
+            (pdf_hash, page_number, dpi, self.tesseract_version)).fetchone()
+
+        return row[0] if row is not None else None
+
+    def put_many(self, pages):
+        """Stores text of pages given as (pdf_hash, page_number, dpi, text) tuples"""
+
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO pages (pdf_hash, page, dpi, tesseract, text) VALUES (?, ?, ?, ?, ?)",
+                [(pdf_hash, page_number, dpi, self.tesseract_version, text)
+                 for pdf_hash, page_number, dpi, text in pages])
+
+    def close(self):
+        """Closes OCR cache"""
+
+        self.connection.close()
+
+
+def ocr_cache_init(args):
+    """Opens OCR cache unless disabled on command line, exits if tesseract is not available"""
+
+    if args.no_ocr_cache:
+        return None
+
+    import pytesseract
+
+    try:
+        tesseract_version = str(pytesseract.get_tesseract_version())
+    except Exception as e:
+        print(f":: Could not get tesseract version: {e}")
+        sys.exit(1)
+
+    return OcrCache(args.ocr_cache, tesseract_version)
+
+
+def parse_ocr_results(nlp: Language, pages, batch):
+    """
+    Parses text of a batch of OCRed pages
+
+    Args:
+        nlp (Language): spacy nlp object with NER
+        pages (list): (pdf_path, page_number) tuples
+        batch: list of (index, text) tuples, text is an exception if OCR failed
+
+    Returns:
+        Generator of (index, pdf_path, result) tuples
+    """
+
+    parsed, failed = [], []
+    for index, text in batch:
+        pdf_path, page_number = pages[index]
+        if isinstance(text, Exception):
+            failed.append((index, {'page': page_number, 'error': str(text)}))
+        else:
+            parsed.append((index, parse_title_page(text, page_number)))
+
+    counters["pages"] += len(batch)
+    counters["ocr_failures"] += len(failed)
+    with Timer("title_page_parsing"):
+        results = add_title_page_dates(nlp, [data for _, data in parsed])
+    for (index, _), result in zip(parsed, results):
+        yield index, pages[index][0], result
+    for index, result in failed:
+        yield index, pages[index][0], result
+
+
+def detect_title_page(args, title_pages):
+    """
+    Detects details of title pages. Pages are rasterized and OCRed by a pool of
+    worker processes while finished pages are parsed by spacy in batches.
+    Text of pages found in OCR cache is parsed without OCR.
+
+    Args:
+        args: parsed command line arguments
+        title_pages (dict): {pdf_path: [page_number, ...]} dict
+
+    Returns:
+        Generator of (index, pdf_path, result) tuples in the order pages are finished,
+        index is position of page in title_pages
+    """
+
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+    from concurrent.futures.process import BrokenProcessPool
+
+    pages = [(pdf_path, page_number) for pdf_path, page_numbers in title_pages.items()
+             for page_number in page_numbers]
+    cache = ocr_cache_init(args)
+    hashes = {}
+    cached = []
+    try:
+        with ProcessPoolExecutor(args.ocr_workers) as executor:
+            futures = {}
+            for index, (pdf_path, page_number) in enumerate(pages):
+                if cache is not None:
+                    if pdf_path not in hashes:
+                        with Timer("ocr_cache"):
+                            hashes[pdf_path] = get_file_hash(pdf_path)
+                    text = cache.get(hashes[pdf_path], page_number, args.dpi) \
+                        if hashes[pdf_path] is not None else None
+                    if text is not None:
+                        cached.append((index, text))
+                        continue
+                futures[executor.submit(ocr_title_page, pdf_path, page_number, args.dpi)] = index
+            counters["ocr_cache_hits"] += len(cached)
+            counters["ocr_cache_misses"] += len(futures)
+
+            # spacy is loaded while the first pages are OCRed
+            import contextualSpellCheck
+            import spacy
+
+            nlp = spacy.load(args.model)
+            contextualSpellCheck.add_to_pipe(nlp)
+
+            for batch in batch_generator(cached, args.batch_size):
+                yield from parse_ocr_results(nlp, pages, batch)
+
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for batch in batch_generator(done, args.batch_size):
+                    texts = []
+                    for future in batch:
+                        try:
+                            texts.append((futures[future], future.result()))
+                        except BrokenProcessPool:
+                            raise
+                        except Exception as e:
+                            texts.append((futures[future], e))
+
+                    if cache is not None:
+                        with Timer("ocr_cache"):
+                            cache.put_many([(hashes[pages[index][0]], pages[index][1], args.dpi, text)
+                                            for index, text in texts
+                                            if not isinstance(text, Exception)
+                                            and hashes[pages[index][0]] is not None])
+                    yield from parse_ocr_results(nlp, pages, texts)
+    except BrokenProcessPool as e:
+        print(f":: OCR worker process failed: {e}")
+        sys.exit(1)
+    finally:
+        if cache is not None:
+            cache.close()
+
+    if cache is not None:
+        print(f":: OCR cache hits: {counters['ocr_cache_hits']}, "
+              f"misses: {counters['ocr_cache_misses']}")
+
+
+def save_title_page_details(results, pages_count: int, save_path: str, output_format: str):
+    """
+    Saves title page details
+
+    Args:
+        results: iterable of (index, pdf_path, result) tuples returned by detect_title_page
+        pages_count (int): number of pages
+        save_path (str): path of file to save data to
+        output_format (str): "json" for {pdf_path: [result, ...]} dict in original page order,
+                             "jsonl" for one record per line written as soon as page is finished
+
+    Returns:
+        None
+    """
+
+    if output_format == "jsonl":
+        with open(save_path, "w", encoding="utf-8") as f:
+            for _, pdf_path, result in results:
+                f.write(json.dumps({"pdf_path": pdf_path, **result}) + "\n")
+                f.flush()
+    else:
+        ordered = [None] * pages_count
+        for index, pdf_path, result in results:
+            ordered[index] = (pdf_path, result)
+
+        details = {}
+        for pdf_path, result in ordered:
+            details.setdefault(pdf_path, []).append(result)
+
+        with open(save_path, "w", encoding="utf-8") as f:
+            json.dump(details, f, indent=4)
+
+    print(f':: Saved title page details to file {save_path}')
+
+
+def preprocess_file_name(file_name: str, strips: List[str]):
+    processed_line = file_name
+    if strips is not None:
+        for s in strips:
+            processed_line = processed_line.replace(s, '')
+
+    processed_line = re.sub(
+        r'\s+', ' ', re.sub(r'([-:.,()\[\]\{\}])', r' \1 ', processed_line.strip()))
+
+    return processed_line
+
+
+def get_doc(file_name: str, strips: List[str]):
+    """Get spacy Doc object for given file"""
+
+    nlp: Language = nlp_data["nlp"]
+    processed_line = preprocess_file_name(file_name, strips)
+    return nlp(processed_line)
+
+
+class TemplateFields(dict):
+    """Template field values, missing fields are rendered as empty string like in jinja"""
+
+    def __missing__(self, key):
+        return ''
+
+
+def compile_simple_template(template_str: str):
+    """
+    Compile template consisting only of literal text and {{field}} placeholders
+    into str.format style format string.
+
+    Args:
+        template_str (str): template string
+
+    Returns:
+        str: format string or None if template requires jinja for rendering
+    """
+
+    parts = SIMPLE_TEMPLATE_RE.split(template_str)
+    literals = parts[0::2]
+    fields = parts[1::2]
+
+    if template_str.endswith('\n') \
+            or any(m in literal for literal in literals for m in ('{{', '{%', '{#')) \
+            or any(field in JINJA_CONSTANTS for field in fields):
+        return None
+
+    format_str = literals[0].replace('{', '{{').replace('}', '}}')
+    for field, literal in zip(fields, literals[1:]):
+        format_str += '{' + field + '}' + \
+            literal.replace('{', '{{').replace('}', '}}')
+
+    return format_str
+
+
+@lru_cache(maxsize=None)
+def compile_template(template_str: str):
+    """
+    Compile template used to generate new file names.
+    Simple templates are rendered using str.format, all others using jinja.
+
+    Args:
+        template_str (str): template string
+
+    Returns:
+        Callable: function accepting dict of field values and returning new file name
+    """
+
+    format_str = compile_simple_template(template_str)
+    if format_str is not None:
+        return lambda fields: format_str.format_map(TemplateFields(fields))
+
+    from jinja2 import Environment
+
+    template = Environment().from_string(template_str)
+    return lambda fields: template.render(**fields)
+
+
+def get_new_file_name(doc: Doc, mandatory: List[str], template_str: str):
+    template = compile_template(template_str)
+
+    enabled = stats_data["enabled"]
+    if enabled:
+        start = time.perf_counter()
+
+    results = {}
+
+    for e in doc.ents:
+        if e.label_ not in nlp_data["patterns"]:
+            print(f":: {e.label_} is not supported")
+            sys.exit(1)
+
+        if enabled:
+            counters[f"label.{e.label_}"] += 1
+
+        result = get_actual_value(e)
+        results = {**results, **result}
+
+    if enabled:
+        extracted = time.perf_counter()
+        counters["time.value_extraction"] += extracted - start
+
+    try:
+        if mandatory is not None and not all(m in results for m in mandatory):
+            return None
+        rendered_output = template(results)
+        if enabled:
+            counters["time.rendering"] += time.perf_counter() - extracted
+        # print(file_name, ' -> ',
+        #      [f'{d.text}' for d in doc], ' => ', rendered_output)
+        return rendered_output
+    except Exception as e:
+        print(e)
+        sys.exit(1)
+
+
+def extract(file_name: str, strips: List[str], mandatory: List[str], template_str: str):
+    """Extracts new file names"""
+
+    doc = get_doc(file_name, strips)
+    return get_new_file_name(doc, mandatory, template_str)
+
+
+def file_generator(files, include: List[str] = None, exclude: List[str] = None,
+                   max_depth: int = None, follow_symlinks: bool = True, skip_hidden: bool = False):
+    """
+    Yields file to be processed. Directories are traversed breadth first.
+
+    Args:
+        files (List[str]): files or directories to process
+        include (List[str]): glob patterns, only matching file names are yielded
+        exclude (List[str]): glob patterns, matching files and directories are skipped
+        max_depth (int): maximum depth of directories to descend into, None for no limit
+        follow_symlinks (bool): descend into symlinked directories
+        skip_hidden (bool): skip files and directories whose name starts with '.'
+
+    Returns:
+        Generator of (dir_name, file_name) tuples
+    """
+
+    file_paths = deque((f, os.path.isdir(f), 0) for f in files)
+
+    while file_paths:
+        file_path, is_dir, depth = file_paths.popleft()
+        if isinstance(file_path, tuple):
+            # already split in (dir_name, file_name) while listing directory
+            yield file_path
+            continue
+
+        if not is_dir:
+            yield os.path.dirname(file_path), os.path.basename(file_path)
+            continue
+
+        if max_depth is not None and depth >= max_depth:
+            continue
+
+        dir_name = file_path.rstrip('/') or file_path
+        with os.scandir(file_path) as entries:
+            for entry in entries:
+                name = entry.name
+                if skip_hidden and name.startswith('.'):
+                    continue
+                if exclude is not None and any(fnmatch(name, e) for e in exclude):
+                    continue
+
+                if entry.is_dir(follow_symlinks=follow_symlinks):
+                    file_paths.append((entry.path, True, depth + 1))
+                elif not follow_symlinks and entry.is_symlink() and entry.is_dir():
+                    continue
+                elif include is None or any(fnmatch(name, i) for i in include):
+                    file_paths.append(((dir_name, name), False, depth + 1))
+
+
+def walk_files(args):
+    """Yields files specified on command line honouring traversal options"""
+
+    files = file_generator(args.file, include=args.include_glob, exclude=args.exclude_glob,
+                           max_depth=args.max_depth, follow_symlinks=not args.no_follow_symlinks,
+                           skip_hidden=args.skip_hidden)
+
+    return timed_generator(files, "traversal") if stats_data["enabled"] else files
+
+
+def predict_init(model: str, file_path: str, use_cache: bool = True):
+    """
+    Loads trained model and patterns for predicting new file names
+
+    Args:
+        model (str): path of trained model
+        file_path (str): file path to load patterns from
+        use_cache (bool): use on disk cache of rendered patterns
+
+    Returns:
+        Language: spacy nlp object
+    """
+
+    import spacy
+    from spacy.tokens import Span
+
+    nlp = spacy.load(model)
+    load_patterns(file_path, use_cache)
+    Span.set_extension("actual_value", getter=get_actual_value, force=True)
+
+    return nlp
+
+
+class ResultCache:
+    """Persistent cache of generated file names stored in SQLite database"""
+
+    def __init__(self, path: str, context: str):
+        """
+        Opens result cache
+
+        Args:
+            path (str): path of SQLite database
+            context (str): key of rules used to generate file names, see get_result_cache_context
+        """
+
+        self.context = context
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS results (
+            context TEXT NOT NULL,
+            name TEXT NOT NULL,
+            new_name TEXT,
+            PRIMARY KEY (context, name))""")
+
+    def get_many(self, names: List[str]):
+        """Returns dict of cached new file names for given preprocessed file names"""
+
+        results = {}
+        names = list(set(names))
+        for i in range(0, len(names), RESULT_CACHE_CHUNK_SIZE):
+            chunk = names[i:i + RESULT_CACHE_CHUNK_SIZE]
+            rows = self.connection.execute(
+                "SELECT name, new_name FROM results WHERE context = ? "
+                f"AND name IN ({','.join('?' * len(chunk))})", [self.context, *chunk])
+            results.update(rows)
+
+        return results
+
+    def put_many(self, results: Dict[str, str]):
+        """Stores new file names for given preprocessed file names"""
+
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO results (context, name, new_name) VALUES (?, ?, ?)",
+                [(self.context, name, new_name) for name, new_name in results.items()])
+
+    def close(self):
+        """Closes result cache"""
+
+        self.connection.close()
+
+
+def get_result_cache_context(args, predict: bool):
+    """
+    Get key of all the rules used to generate new file names. Rendered patterns are
+    hashed, so changes of templates included by patterns file are covered as well.
+    Patterns must be loaded before calling, see pipeline_init.
+    Cached results are only reused when the key matches.
+
+    Args:
+        args: parsed command line arguments
+        predict (bool): use trained model instead of rule based matching
+
+    Returns:
+        str: hex digest of rules
+    """
+
+    patterns_hash = hashlib.sha256(
+        json.dumps(nlp_data["patterns"], sort_keys=True, default=str).encode()).hexdigest()
+    rules = [RESULT_CACHE_VERSION, patterns_hash, args.template,
+             sorted(args.mandatory or []), args.excludes]
+    if predict:
+        meta_path = os.path.join(args.model, 'meta.json')
+        rules += [os.path.abspath(args.model),
+                  os.path.getmtime(meta_path) if os.path.exists(meta_path) else None]
+
+    return hashlib.sha256(json.dumps(rules).encode()).hexdigest()
+
+
+def pipeline_init(args, predict: bool):
+    """
+    Initializes spacy pipeline used to generate new file names
+
+    Args:
+        args: parsed command line arguments
+        predict (bool): use trained model instead of rule based matching
+
+    Returns:
+        tuple: (nlp, strips) tuple
+    """
+
+    if predict:
+        return predict_init(args.model, args.load, not args.no_pattern_cache), None
+
+    if args.engine == 'fast':
+        fast_init(args.load, not args.no_pattern_cache)
+    else:
+        nlp_init(args.load, not args.no_pattern_cache)
+    return nlp_data["nlp"], args.excludes
+
+
+def batch_generator(items, batch_size: int):
+    """Yields lists of at most batch_size items"""
+
+    items = iter(items)
+    while True:
+        batch = list(islice(items, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def generate_names(nlp: Language, entries, strips: List[str], args, cache: ResultCache = None,
+                   dedupe: Dict[str, str] = None):
+    """
+    Generates new file names using batched spacy pipeline.
+    File names found in result cache are not processed by spacy pipeline.
+
+    Args:
+        nlp (Language): spacy nlp object
+        entries: iterable of (dir_name, file_name) tuples
+        strips (List[str]): strings to be removed from file names
+        args: parsed command line arguments
+        cache (ResultCache): optional result cache
+        dedupe (dict): optional new file names of preprocessed file names seen earlier
+                       in this run, updated with every processed name
+
+    Returns:
+        Generator of (dir_name, file_name, new_file_name) tuples
+    """
+
+    # names that patterns can not match are skipped, this does not apply to trained models
+    prefilter = None
+    if args.mandatory and nlp is nlp_data["nlp"]:
+        prefilter = get_prefilter(args.mandatory)
+
+    for batch in batch_generator(entries, args.batch_size):
+        counters["files"] += len(batch)
+        with Timer("preprocessing"):
+            texts = [preprocess_file_name(file_name, strips) for _, file_name in batch]
+
+        pending = texts if dedupe is None else [text for text in texts if text not in dedupe]
+        unique = list(dict.fromkeys(pending))
+        rejected = {}
+        if prefilter is not None:
+            with Timer("prefilter"):
+                rejected = {text: None for text in unique if not prefilter(text)}
+            counters["prefilter_skipped"] += sum(1 for text in pending if text in rejected)
+            pending = [text for text in pending if text not in rejected]
+        new_names = {}
+        if cache is not None:
+            with Timer("result_cache"):
+                new_names = cache.get_many(pending)
+            hits = sum(1 for text in pending if text in new_names)
+            counters["result_cache_hits"] += hits
+            counters["result_cache_misses"] += len(pending) - hits
+
+        misses = [text for text in dict.fromkeys(pending) if text not in new_names]
+        with Timer("pipeline"):
+            docs = list(nlp.pipe(misses, batch_size=args.batch_size))
+        generated = {text: get_new_file_name(doc, args.mandatory, args.template)
+                     for text, doc in zip(misses, docs)}
+        if cache is not None and generated:
+            with Timer("result_cache"):
+                cache.put_many(generated)
+        new_names.update(generated)
+        new_names.update(rejected)
+
+        if dedupe is not None:
+            counters["unique_names"] += len(unique)
+            dedupe.update(new_names)
+            new_names = dedupe
+
+        for (dir_name, file_name), text in zip(batch, texts):
+            yield dir_name, file_name, new_names[text]
+
+
+def init_worker(args, predict: bool):
+    """Initializes worker process with a warm spacy pipeline"""
+
+    stats_data["enabled"] = is_stats_enabled(args)
+    worker_data["args"] = args
+    worker_data["nlp"], worker_data["strips"] = pipeline_init(args, predict)
+    worker_data["dedupe"] = {} if args.dedupe else None
+    if args.result_cache is not None:
+        worker_data["cache"] = ResultCache(
+            args.result_cache, get_result_cache_context(args, predict))
+
+
+def process_shard(shard):
+    """
+    Generates new file names for files in a single directory shard.
+    This function is executed inside worker process.
+
+    Args:
+        shard (tuple): (dir_name, file_names) tuple
+
+    Returns:
+        tuple: (dir_name, [(file_name, new_file_name), ...], counters) tuple
+    """
+
+    dir_name, file_names = shard
+    entries = ((dir_name, file_name) for file_name in file_names)
+    names = generate_names(worker_data["nlp"], entries, worker_data["strips"],
+                           worker_data["args"], worker_data["cache"], worker_data["dedupe"])
+
+    results = [(file_name, file_name_new) for _, file_name, file_name_new in names]
+    shard_counters = dict(counters)
+    counters.clear()
+
+    return dir_name, results, shard_counters
+
+
+def shard_generator(entries, shard_size: int):
+    """
+    Groups consecutive files of the same directory into shards
+
+    Args:
+        entries: iterable of (dir_name, file_name) tuples
+        shard_size (int): maximum number of files in a shard
+
+    Returns:
+        Generator of (dir_name, file_names) tuples
+    """
+
+    for dir_name, group in groupby(entries, key=lambda entry: entry[0]):
+        file_names = []
+        for _, file_name in group:
+            file_names.append(file_name)
+            if len(file_names) >= shard_size:
+                yield dir_name, file_names
+                file_names = []
+
+        if file_names:
+            yield dir_name, file_names
+
+
+def dedupe_shards(shards, dispatched: set, originals: deque):
+    """
+    Removes file names already sent to workers in earlier shards, so that a file name
+    occurring in many directories is processed only once.
+    Complete file names of every shard are appended to originals.
+
+    Args:
+        shards: iterable of (dir_name, file_names) tuples
+        dispatched (set): file names sent to workers so far, updated in place
+        originals (deque): file names of shards before removing duplicates
+
+    Returns:
+        Generator of (dir_name, file_names) tuples
+    """
+
+    for dir_name, file_names in shards:
+        originals.append(file_names)
+        unique = [file_name for file_name in dict.fromkeys(file_names) if file_name not in dispatched]
+        dispatched.update(unique)
+        counters["files"] += len(file_names) - len(unique)
+        yield dir_name, unique
+
+
+def ordered_map(executor, fn, items, max_pending: int):
+    """
+    Like executor.map, but keeps at most max_pending items in flight.
+    Results are returned in the order of items.
+    """
+
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
+
+
+def name_generator(args, predict: bool = False):
+    """
+    Generates new file names for all files specified on command line.
+    If more than one worker is requested, files are processed by a pool
+    of worker processes, one directory shard at a time.
+
+    Args:
+        args: parsed command line arguments
+        predict (bool): use trained model instead of rule based matching
+
+    Returns:
+        Generator of (dir_name, file_name, new_file_name) tuples
+    """
+
+    if args.workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        from concurrent.futures.process import BrokenProcessPool
+
+        shards = shard_generator(walk_files(args), args.batch_size)
+        if args.dedupe:
+            # shards are returned in order, so duplicates of a file name always
+            # come after the shard in which it was processed
+            originals = deque()
+            new_names = {}
+            shards = dedupe_shards(shards, set(), originals)
+        try:
+            with ProcessPoolExecutor(args.workers, initializer=init_worker,
+                                     initargs=(args, predict)) as executor:
+                for dir_name, file_names, shard_counters in ordered_map(executor, process_shard, shards, args.workers * 2):
+                    counters.update(shard_counters)
+                    if args.dedupe:
+                        new_names.update(file_names)
+                        file_names = [(file_name, new_names[file_name])
+                                      for file_name in originals.popleft()]
+                    for file_name, file_name_new in file_names:
+                        yield dir_name, file_name, file_name_new
+        except BrokenProcessPool as e:
+            print(f":: Worker process failed: {e}")
+            sys.exit(1)
+    else:
+        nlp, strips = pipeline_init(args, predict)
+        cache = None
+        if args.result_cache is not None:
+            cache = ResultCache(args.result_cache,
+                                get_result_cache_context(args, predict))
+
+        yield from generate_names(nlp, walk_files(args), strips, args, cache,
+                                  {} if args.dedupe else None)
+
+        if cache is not None:
+            cache.close()
+
+    if args.result_cache is not None:
+        print(f":: Result cache hits: {counters['result_cache_hits']}, "
+              f"misses: {counters['result_cache_misses']}")
+    if counters["prefilter_skipped"]:
+        print(f":: Skipped by mandatory fields prefilter: {counters['prefilter_skipped']} "
+              f"of {counters['files']} files")
+    if args.dedupe:
+        unique = counters['unique_names']
+        print(f":: Unique file names: {unique} of {counters['files']} files "
+              f"(dedupe ratio {counters['files'] / unique if unique else 0:.2f})")
+
+
+def multi_extract(args):
+    """Extracts new file names"""
+
+    results = {}
+
+    for dir_name, file_name, file_name_new in name_generator(args):
+        result = results.get(dir_name, {})
+        result[file_name] = file_name_new
+        results[dir_name] = result
+
+    return results
+
+
+def multi_predict(args):
+    """Predict new file names"""
+
+    results = {}
+
+    for dir_name, file_name, file_name_new in name_generator(args, predict=True):
+        result = results.get(dir_name, {})
+        result[file_name] = file_name_new
+        results[dir_name] = result
+
+    return results
+
+
+class ShardWriter:
+    """Writes docs into DocBin shards of fixed size stored in a directory"""
+
+    def __init__(self, path: str, shard_size: int):
+        """
+        Prepares directory for shards, shards left from earlier runs are removed
+
+        Args:
+            path (str): directory of shards
+            shard_size (int): maximum number of docs in a shard
+        """
+
+        if os.path.isfile(path):
+            os.remove(path)
+        os.makedirs(path, exist_ok=True)
+        for file_name in os.listdir(path):
+            if fnmatch(file_name, 'shard-*.spacy'):
+                os.remove(os.path.join(path, file_name))
+
+        self.path = path
+        self.shard_size = shard_size
+        self.doc_bin = None
+        self.shards = 0
+        self.docs = 0
+
+    def add(self, doc: Doc):
+        """Adds doc, writes shard when it is full"""
+
+        from spacy.tokens import DocBin
+
+        if self.doc_bin is None:
+            self.doc_bin = DocBin()
+        self.doc_bin.add(doc)
+        self.docs += 1
+        if len(self.doc_bin) >= self.shard_size:
+            self.flush()
+
+    def flush(self):
+        """Writes docs added since last shard"""
+
+        if self.doc_bin is None:
+            return
+
+        self.doc_bin.to_disk(os.path.join(self.path, f"shard-{self.shards:05d}.spacy"))
+        self.doc_bin = None
+        self.shards += 1
+
+
+def split_generator(entries, strips: List[str], args):
+    """
+    Assigns preprocessed file names to training or test data. Assignment depends only
+    on the name and seed, so identical names always end up in the same data set and
+    runs with the same seed are reproducible.
+
+    Args:
+        entries: iterable of (dir_name, file_name) tuples
+        strips (List[str]): strings to be removed from file names
+        args: parsed command line arguments
+
+    Returns:
+        Generator of (text, is_train) tuples
+    """
+
+    seen = set() if args.dedupe else None
+    for _, file_name in entries:
+        text = preprocess_file_name(file_name, strips)
+        key = int.from_bytes(hashlib.sha256(f"{args.seed}:{text}".encode()).digest()[:8], 'big')
+        if seen is not None:
+            if key in seen:
+                counters["duplicates"] += 1
+                continue
+            seen.add(key)
+
+        yield text, key % 100 < args.percentage
+
+
+def generate_training_data(args):
+    """
+    Generate training data, docs are written to shards as they are generated
+
+    Returns:
+        tuple: (train, test) ShardWriter objects
+    """
+
+    nlp_init(args.load, not args.no_pattern_cache)
+    train = ShardWriter(args.training_save_path, args.shard_size)
+    test = ShardWriter(args.testing_save_path, args.shard_size)
+
+    texts = split_generator(walk_files(args), args.excludes, args)
+    for doc, is_train in nlp_data["nlp"].pipe(texts, as_tuples=True, batch_size=args.batch_size):
+        (train if is_train else test).add(doc)
+
+    train.flush()
+    test.flush()
+
+    return train, test
+
+
+def read_docs(path: str, vocab):
+    """
+    Reads docs saved by generate command
+
+    Args:
+        path (str): DocBin file or directory of DocBin shards
+        vocab: spacy vocab used to create docs
+
+    Returns:
+        Generator of Doc objects
+    """
+
+    from spacy.tokens import DocBin
+
+    if os.path.isdir(path):
+        paths = [os.path.join(path, file_name) for file_name in sorted(os.listdir(path))
+                 if file_name.endswith('.spacy')]
+    else:
+        paths = [path]
+
+    for doc_bin_path in paths:
+        yield from DocBin().from_disk(doc_bin_path).get_docs(vocab)
+
+
+def evaluation_init(engine: str, args):
+    """
+    Initializes engine evaluated by evaluate command
+
+    Args:
+        engine (str): one of "extract", "fast" or "predict"
+        args: parsed command line arguments
+
+    Returns:
+        nlp object of engine
+    """
+
+    if engine == "predict":
+        return predict_init(args.model, args.load, not args.no_pattern_cache)
+
+    if engine == "fast":
+        fast_init(args.load, not args.no_pattern_cache)
+    else:
+        nlp_init(args.load, not args.no_pattern_cache)
+    return nlp_data["nlp"]
+
+
+def percentile(values: List[float], percent: float):
+    """Returns percentile of sorted values using nearest rank"""
+
+    if not values:
+        return None
+
+    return values[min(len(values) - 1, max(0, math.ceil(percent / 100 * len(values)) - 1))]
+
+
+def get_scores(tp: int, fp: int, fn: int):
+    """Returns precision, recall and F1 score, undefined scores are 0 like in spacy"""
+
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+
+    return {"precision": precision, "recall": recall, "f1": f1, "tp": tp, "fp": fp, "fn": fn}
+
+
+def evaluate_engine(nlp, args):
+    """
+    Compares entities found by engine with entities of reference docs
+
+    Args:
+        nlp: nlp object of evaluated engine
+        args: parsed command line arguments
+
+    Returns:
+        dict: per label and overall scores, throughput and latency of engine
+    """
+
+    import spacy
+
+    vocab = spacy.blank("en").vocab
+    counts = {}
+    docs = 0
+    elapsed = 0.0
+    samples = []
+    for batch in batch_generator(read_docs(args.data, vocab), args.batch_size):
+        texts = [doc.text for doc in batch]
+        if len(samples) < args.latency_samples:
+            samples.extend(texts[:args.latency_samples - len(samples)])
+
+        start = time.perf_counter()
+        predicted = list(nlp.pipe(texts, batch_size=args.batch_size))
+        elapsed += time.perf_counter() - start
+        docs += len(batch)
+
+        for reference, doc in zip(batch, predicted):
+            gold = {(e.start, e.end, e.label_) for e in reference.ents}
+            found = {(e.start, e.end, e.label_) for e in doc.ents}
+            for label in {label for _, _, label in gold | found}:
+                count = counts.setdefault(label, Counter())
+                count["tp"] += sum(1 for e in found & gold if e[2] == label)
+                count["fp"] += sum(1 for e in found - gold if e[2] == label)
+                count["fn"] += sum(1 for e in gold - found if e[2] == label)
+
+    # latency is measured with warm caches, after the throughput pass
+    latencies = []
+    for text in samples:
+        start = time.perf_counter()
+        nlp(text)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+
+    total = sum(counts.values(), Counter())
+    return {
+        "docs": docs,
+        "docs_per_second": docs / elapsed if elapsed else None,
+        "latency_p50_ms": percentile(latencies, 50) * 1000 if latencies else None,
+        "latency_p99_ms": percentile(latencies, 99) * 1000 if latencies else None,
+        "ents": get_scores(total["tp"], total["fp"], total["fn"]),
+        "labels": {label: get_scores(count["tp"], count["fp"], count["fn"])
+                   for label, count in sorted(counts.items())},
+    }
+
+
+def evaluate(args):
+    """
+    Evaluates accuracy and speed of engines on reference docs
+
+    Args:
+        args: parsed command line arguments
+
+    Returns:
+        dict: {engine: results} dict, see evaluate_engine
+    """
+
+    engines = args.engines or (["extract", "predict"] if args.model is not None else ["extract"])
+    if "predict" in engines and args.model is None:
+        print(":: Evaluating predict requires --model")
+        sys.exit(1)
+
+    results = {}
+    for engine in engines:
+        nlp = evaluation_init(engine, args)
+        results[engine] = evaluate_engine(nlp, args)
+
+        result = results[engine]
+        print(f":: {engine:8} {result['docs']} docs, {result['docs_per_second'] or 0:.1f} docs/s, "
+              f"p50 {result['latency_p50_ms'] or 0:.3f} ms, p99 {result['latency_p99_ms'] or 0:.3f} ms, "
+              f"P {result['ents']['precision']:.3f} R {result['ents']['recall']:.3f} "
+              f"F1 {result['ents']['f1']:.3f}")
+        for label, scores in result["labels"].items():
+            print(f"::   {label:15} P {scores['precision']:.3f} R {scores['recall']:.3f} "
+                  f"F1 {scores['f1']:.3f}")
+
+    return results
+
+
+class LocalFileSystem:
+    """
+    File system operations used for renaming files. Directories are opened once and
+    files are renamed relative to directory file descriptor, so every rename does not
+    resolve full path again. On platforms without dir_fd support full paths are used.
+    Renames never replace existing files, names matched only by a case insensitive or
+    normalizing file system are reported as FileExistsError.
+    """
+
+    def __init__(self):
+        self.use_dir_fd = os.rename in os.supports_dir_fd and os.listdir in os.supports_fd
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            self.renameat2 = getattr(libc, 'renameat2', None)
+        except (OSError, TypeError):
+            self.renameat2 = None
+
+    def open_dir(self, dir_name: str):
+        """Opens directory and returns handle used by other operations"""
+
+        if self.use_dir_fd:
+            return os.open(dir_name or '.', os.O_RDONLY | os.O_DIRECTORY)
+        return dir_name
+
+    def close_dir(self, handle):
+        """Closes directory handle returned by open_dir"""
+
+        if self.use_dir_fd:
+            os.close(handle)
+
+    def listdir(self, handle):
+        """Returns names of files in directory"""
+
+        return os.listdir(handle if self.use_dir_fd else handle or '.')
+
+    def exists(self, handle, name: str):
+        """Checks if file with given name exists in directory"""
+
+        try:
+            if self.use_dir_fd:
+                os.stat(name, dir_fd=handle, follow_symlinks=False)
+            else:
+                os.lstat(os.path.join(handle, name))
+        except OSError:
+            return False
+        return True
+
+    def rename(self, handle, source: str, target: str):
+        """Renames file within directory, raises FileExistsError if target exists"""
+
+        if self.use_dir_fd:
+            dir_fd, source_path, target_path = handle, source, target
+        else:
+            dir_fd, source_path, target_path = None, os.path.join(handle, source), os.path.join(handle, target)
+
+        try:
+            self.rename_noreplace(dir_fd, source_path, target_path)
+        except FileExistsError:
+            if source.casefold() != target.casefold() or not self.same_file(dir_fd, source_path, target_path):
+                raise
+            # changing only case of the name on case insensitive file system
+            os.rename(source_path, target_path, src_dir_fd=dir_fd, dst_dir_fd=dir_fd)
+
+    def rename_noreplace(self, dir_fd, source: str, target: str):
+        """
+        Renames file without replacing existing target. Uses renameat2 with RENAME_NOREPLACE
+        when available, otherwise hard link followed by unlink. File systems supporting
+        neither are checked for target before renaming.
+        """
+
+        if self.renameat2 is not None:
+            fd = AT_FDCWD if dir_fd is None else dir_fd
+            if self.renameat2(fd, os.fsencode(source), fd, os.fsencode(target), RENAME_NOREPLACE) == 0:
+                return
+            error = ctypes.get_errno()
+            if error not in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+                raise OSError(error, os.strerror(error), source, None, target)
+
+        try:
+            os.link(source, target, src_dir_fd=dir_fd, dst_dir_fd=dir_fd, follow_symlinks=False)
+        except FileExistsError:
+            raise
+        except (OSError, NotImplementedError):
+            # hard links are not supported
+            try:
+                os.stat(target, dir_fd=dir_fd, follow_symlinks=False)
+            except FileNotFoundError:
+                os.rename(source, target, src_dir_fd=dir_fd, dst_dir_fd=dir_fd)
+            else:
+                raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), source, None, target)
+        else:
+            os.unlink(source, dir_fd=dir_fd)
+
+    @staticmethod
+    def same_file(dir_fd, source: str, target: str):
+        """Checks if both names refer to the same file"""
+
+        try:
+            source_stat = os.stat(source, dir_fd=dir_fd, follow_symlinks=False)
+            target_stat = os.stat(target, dir_fd=dir_fd, follow_symlinks=False)
+        except OSError:
+            return False
+        return (source_stat.st_dev, source_stat.st_ino) == (target_stat.st_dev, target_stat.st_ino)
+
+
+class LatencyFileSystem:
+    """File system wrapper adding fixed latency to every operation, simulates network file systems"""
+
+    def __init__(self, fs, latency: float):
+        self.fs = fs
+        self.latency = latency
+
+    def open_dir(self, dir_name: str):
+        time.sleep(self.latency)
+        return self.fs.open_dir(dir_name)
+
+    def close_dir(self, handle):
+        self.fs.close_dir(handle)
+
+    def listdir(self, handle):
+        time.sleep(self.latency)
+        return self.fs.listdir(handle)
+
+    def exists(self, handle, name: str):
+        time.sleep(self.latency)
+        return self.fs.exists(handle, name)
+
+    def rename(self, handle, source: str, target: str):
+        time.sleep(self.latency)
+        self.fs.rename(handle, source, target)
+
+
+class RenameJournal:
+    """
+    Append only journal of completed renames, one JSON record per line.
+    Every record is written to the file as soon as its rename is done, so it survives
+    the process being killed. Records are synced to disk in groups (group commit),
+    either when JOURNAL_COMMIT_SIZE records were written or JOURNAL_COMMIT_INTERVAL
+    seconds have passed since last sync.
+    """
+
+    def __init__(self, path: str, append: bool = False):
+        self.file = open(path, 'a+' if append else 'w', encoding='utf-8')
+        if append and self.file.tell() > 0:
+            # terminate incomplete last line left by a crash
+            self.file.seek(self.file.tell() - 1)
+            if self.file.read(1) != '\n':
+                self.file.write('\n')
+        self.lock = threading.Lock()
+        self.unsynced = 0
+        self.last_commit = time.monotonic()
+
+    def append(self, record: Dict[str, Any]):
+        """Writes record to journal"""
+
+        line = json.dumps(record) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            self.unsynced += 1
+            if self.unsynced >= JOURNAL_COMMIT_SIZE \
+                    or time.monotonic() - self.last_commit >= JOURNAL_COMMIT_INTERVAL:
+                self.commit()
+
+    def commit(self):
+        """Syncs written records to disk, caller must hold the lock"""
+
+        if self.unsynced:
+            os.fsync(self.file.fileno())
+            self.unsynced = 0
+        self.last_commit = time.monotonic()
+
+    def sync(self):
+        """Syncs written records to disk"""
+
+        with self.lock:
+            self.commit()
+
+    def close(self):
+        """Syncs remaining records and closes journal"""
+
+        self.sync()
+        self.file.close()
+
+
+def read_journal(path: str):
+    """
+    Reads rename journal. Incomplete last line left by a crash is ignored.
+
+    Args:
+        path (str): journal file path
+
+    Returns:
+        dict: latest journal record for every original path
+    """
+
+    records = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            records[record["original_path"]] = record
+
+    return records
+
+
+def recover_journal(path: str):
+    """
+    Reads rename journal of an interrupted run and finishes interrupted swaps of names.
+    A file left at temporary name is moved back to its original name, so it is renamed
+    again. If the original name is already taken by the other swapped file, the file is
+    moved to its planned name instead and the move is recorded in the journal.
+
+    Args:
+        path (str): journal file path
+
+    Returns:
+        tuple: (completed, failed) tuple, completed maps original path to journal record
+               of completed rename, failed is list of original paths of files which could
+               not be recovered
+    """
+
+    try:
+        records = read_journal(path)
+    except FileNotFoundError:
+        print(f":: Journal {path} not found, nothing to resume")
+        return {}, []
+
+    completed = {}
+    failed = []
+    finished = []
+    for original_path, record in records.items():
+        if record["final"]:
+            completed[original_path] = record
+            continue
+
+        temp_path = record["actual_new_path"]
+        try:
+            if not os.path.lexists(original_path):
+                os.rename(temp_path, original_path)
+                continue
+
+            # swap was interrupted after the other file took the original name
+            planned_path = record.get("planned_path") or os.path.join(
+                os.path.dirname(original_path), record["proposed_name"])
+            if os.path.lexists(planned_path):
+                raise FileExistsError(f"{planned_path} already exists")
+            os.rename(temp_path, planned_path)
+        except OSError as e:
+            print(f":: Could not recover {original_path} from {temp_path}: {e}")
+            failed.append(original_path)
+            continue
+
+        record = {"original_path": original_path, "actual_new_path": planned_path,
+                  "proposed_name": record["proposed_name"], "final": True}
+        completed[original_path] = record
+        finished.append(record)
+
+    if finished:
+        journal = RenameJournal(path, append=True)
+        for record in finished:
+            journal.append(record)
+        journal.close()
+
+    return completed, failed
+
+
+def rename_file(fs, handle, dir_name: str, source: str, new_name: str):
+    """
+    Rename a file - if a file with new_name already exists a counter is used to generate unique name
+
+    Args:
+        fs: file system, see LocalFileSystem
+        handle: directory handle returned by fs.open_dir
+        dir_name (str): directory containing file, used in error messages
+        source (str): current file name
+        new_name (str): new file name
+
+    Returns:
+        str: actual new file name or None if rename failed
+    """
 
-        index = input_rules["index"]
+    original_base_name, original_ext = os.path.splitext(new_name)
 
-        if index == "start":
-            return span.doc[span.start].text
-        if index == "end":
-            return span.doc[span.end - 1].text
+    counter = 1
+    target = new_name
+
+    while True:
+        if not fs.exists(handle, target):
+            try:
+                fs.rename(handle, source, target)
+                return target
+            except FileExistsError:
+                # created since checked or matched by case insensitive file system
+                pass
+            except OSError as e:
+                print(f"Error renaming file {os.path.join(dir_name, source)}: {e}")
+                return None
 
-        if not isinstance(index, int):
-            print(":: index is non numeric")
-            sys.exit(1)
+        # Construct new name with suffix
+        target = f"{original_base_name}-{counter}{original_ext}"
+        counter += 1
 
-        return span.doc[index].text
-    if input_type == "all":
-        return span.text
-    if input_type == "distinct":
-        if "indexes" not in input_rules:
-            print(":: indexes field is mandatory for input type distinct")
-            sys.exit(1)
 
-        result = []
-        for index in input_rules["indexes"]:
-            if isinstance(index, int):
-                if index < 0:
-                    index += span.end
-                else:
-                    index += span.start
-            else:
-                if index == "start":
-                    index = span.start
-                elif index == "end":
-                    index = span.end - 1
-                else:
-                    print(f":: index keyword {index} is not supported")
-                    sys.exit(1)
+def plan_renames(listing, renames):
+    """
+    Plans renames of files in a single directory. Name collisions are resolved in memory
+    against the directory listing and other files renamed in the same batch, including
+    chains (a -> b, b -> c) and swaps (a -> b, b -> a).
 
-                result.append(span.doc[index].text)
-        return result
+    Args:
+        listing (set): names of files present in directory
+        renames (list): (file_name, new_file_name) tuples
 
-    if input_type == "multi":
-        if "start" not in input_rules or input_rules["start"] == "start":
-            start = span.start
-        else:
-            if not isinstance(input_rules["start"], int):
-                print(":: start is non numeric")
-                sys.exit(1)
-            start = span.start + int(input_rules["start"])
+    Returns:
+        tuple: (targets, steps) tuple, where targets maps file_name to planned name and
+               steps is list of (source_name, target_name, file_name, final) tuples in
+               execution order. Non final steps move file to temporary name.
+    """
 
-        if "end" not in input_rules or input_rules["end"] == "end":
-            end = span.end
-        else:
-            if not isinstance(input_rules["end"], int):
-                print(":: end is non numeric")
-                sys.exit(1)
-            end = span.start + int(input_rules["end"])
+    moving = {file_name for file_name, _ in renames if file_name in listing}
+    taken = listing - moving
+    targets = {}
+
+    for file_name, new_name in renames:
+        base_name, ext = os.path.splitext(new_name)
+        target = new_name
+        counter = 1
+        while target in taken:
+            target = f"{base_name}-{counter}{ext}"
+            counter += 1
+        taken.add(target)
+        targets[file_name] = target
+
+    steps = []
+    done = set()
+
+    for file_name, _ in renames:
+        # follow chain of files whose planned name is currently taken by another moving file
+        path = []
+        positions = {}
+        current = file_name
+        while current is not None and current not in done and current not in positions:
+            positions[current] = len(path)
+            path.append(current)
+            target = targets[current]
+            current = target if target in moving and target != current else None
+
+        prefix = path
+        if current in positions:
+            prefix = path[:positions[current]]
+            cycle = path[positions[current]:]
+            temp = f".{cycle[0]}.renaming"
+            while temp in taken or temp in listing:
+                temp = f".{temp}"
+            taken.add(temp)
+
+            steps.append((cycle[0], temp, cycle[0], False))
+            for name in reversed(cycle[1:]):
+                steps.append((name, targets[name], name, True))
+            steps.append((temp, targets[cycle[0]], cycle[0], True))
+
+        for name in reversed(prefix):
+            steps.append((name, targets[name], name, True))
+
+        done.update(path)
+
+    return targets, steps
+
+
+def remove_conflicts(dir_name: str, listing, renames):
+    """
+    Removes renames which can not be done using exact new name, because the file is
+    missing or new name is taken. Used when restoring files to their original names.
 
-        return [span.doc[i].text for i in range(start, end)]
+    Args:
+        dir_name (str): directory containing files, used in messages
+        listing (set): names of files present in directory
+        renames (list): (file_name, new_file_name) tuples
 
-    print(f":: Unsupported input type: {input_type}")
-    sys.exit(1)
+    Returns:
+        tuple: (renames, conflicts) tuple of renames without conflicts and number of
+               removed renames
+    """
 
+    conflicts = 0
+    while True:
+        targets, _ = plan_renames(listing, renames)
+        valid = [(file_name, new_name) for file_name, new_name in renames
+                 if file_name in listing and targets[file_name] == new_name]
+        if len(valid) == len(renames):
+            return renames, conflicts
 
-def convert_roman_nums_handler(value: str):
-    if value.isnumeric():
-        return value
+        for file_name, new_name in renames:
+            if file_name not in listing:
+                print(f":: Conflict: {os.path.join(dir_name, file_name)} does not exist")
+            elif targets[file_name] != new_name:
+                print(f":: Conflict: {os.path.join(dir_name, new_name)} already exists")
+        conflicts += len(renames) - len(valid)
+        renames = valid
 
-    return str(roman_to_int(value.upper()))
 
+def probe_renames(fs, handle, dir_name: str, renames, journal: RenameJournal = None):
+    """
+    Renames files one by one using rename_file, checking every new name on the file system.
+    Used when directory can not be listed, so renames can not be planned.
 
-def date_handler(value: str, format: str):
-    try:
-        p = parser.parse(value)
-        return p.strftime(format)
-    except parser.ParserError as e:
-        print(f":: Invalid date '{value}': {e}")
-        sys.exit(1)
+    Args:
+        fs: file system, see LocalFileSystem
+        handle: directory handle returned by fs.open_dir
+        dir_name (str): directory containing files
+        renames (list): (file_name, new_file_name) tuples
+        journal (RenameJournal): optional journal recording every completed rename
 
+    Returns:
+        tuple: (targets, actual, conflicts) tuple, see rename_dir
+    """
 
-def joiner_handler(values: List[Any], separator: str,
-                   exclusions: List[Any] = None, outputs: List[Any] = None):
-    if outputs is None:
-        values = [v for v in values if exclusions is None or v not in exclusions]
-        return separator.join(map(str, values))
+    actual = {}
+    for file_name, new_name in renames:
+        if file_name == new_name:
+            actual[file_name] = file_name
+            continue
 
-    if len(values) != len(outputs):
-        print(":: multi output handling: count of values and outputs do not match")
-        sys.exit(1)
+        target = rename_file(fs, handle, dir_name, file_name, new_name)
+        actual[file_name] = target
+        if target is not None and journal is not None:
+            journal.append({"original_path": os.path.join(dir_name, file_name),
+                            "actual_new_path": os.path.join(dir_name, target),
+                            "proposed_name": new_name,
+                            "final": True})
 
-    return separator.join([get_value(values[i], outputs[i]) for i in range(len(values))])
+    return dict(renames), actual, 0
 
 
-def get_value(value, output: Dict[str, Any]):
-    if 'handler' not in output:
-        return value
+def rename_dir(fs, dir_name: str, renames, journal: RenameJournal = None, exact: bool = False):
+    """
+    Renames files in a single directory. Directory is opened and listed only once and
+    the renames are planned using plan_renames. If a planned name is still taken because
+    renaming another file failed, or the file system reports it as existing although it
+    is not in the listing (case insensitive or normalizing file systems), the file falls
+    back to rename_file. Existing files are never replaced.
 
-    handlers = {
-        "convert_roman_nums": convert_roman_nums_handler,
-        "date": date_handler,
-        "joiner": joiner_handler,
-    }
-    handler = output["handler"]
+    Args:
+        fs: file system, see LocalFileSystem
+        dir_name (str): directory containing files
+        renames (list): (file_name, new_file_name) tuples
+        journal (RenameJournal): optional journal recording every completed rename
+        exact (bool): only rename files which can get exactly their new name, see remove_conflicts
 
-    if handler not in handlers:
-        print(f":: Handler {handler} is not implemented")
-        sys.exit(1)
+    Returns:
+        tuple: (targets, actual, conflicts) tuple, targets and actual map file_name to
+               planned and actual name, actual name is None when rename failed, conflicts
+               is number of renames removed by remove_conflicts
+    """
 
-    return handlers[handler](value, **output.get("args", {}))
+    try:
+        handle = fs.open_dir(dir_name)
+    except OSError as e:
+        print(f"Error opening directory {dir_name}: {e}")
+        return {file_name: new_name for file_name, new_name in renames}, {}, 0
 
+    try:
+        try:
+            listing = set(fs.listdir(handle))
+        except OSError as e:
+            print(f"Error listing directory {dir_name}: {e}")
+            if exact:
+                return {file_name: new_name for file_name, new_name in renames}, {}, 0
+            return probe_renames(fs, handle, dir_name, renames, journal)
+
+        conflicts = 0
+        if exact:
+            renames, conflicts = remove_conflicts(dir_name, listing, renames)
+
+        targets, steps = plan_renames(listing, renames)
+        new_names = dict(renames)
+        actual = {}
+        remaining = set()
+
+        for source, target, file_name, final in steps:
+            if file_name in remaining:
+                continue
+
+            if target in remaining:
+                # planned name is still taken by file which could not be renamed
+                target = rename_file(fs, handle, dir_name, source, new_names[file_name])
+            elif source != target:
+                try:
+                    fs.rename(handle, source, target)
+                except FileExistsError:
+                    if not final:
+                        print(f"Error renaming file {os.path.join(dir_name, source)}: "
+                              f"{os.path.join(dir_name, target)} already exists")
+                        target = None
+                    elif exact and source == file_name:
+                        print(f":: Conflict: {os.path.join(dir_name, target)} already exists")
+                        conflicts += 1
+                        target = None
+                    else:
+                        target = rename_file(fs, handle, dir_name, source, new_names[file_name])
+                except OSError as e:
+                    print(f"Error renaming file {os.path.join(dir_name, source)}: {e}")
+                    target = None
+
+            if target is not None:
+                actual[file_name] = target
+                if journal is not None:
+                    record = {"original_path": os.path.join(dir_name, file_name),
+                              "actual_new_path": os.path.join(dir_name, target),
+                              "proposed_name": new_names[file_name],
+                              "final": final}
+                    if not final:
+                        record["planned_path"] = os.path.join(dir_name, targets[file_name])
+                    journal.append(record)
+            elif source == file_name:
+                actual[file_name] = None
+                remaining.add(file_name)
+    finally:
+        fs.close_dir(handle)
+
+    return targets, actual, conflicts
+
+
+def rename_files(file_data, workers: int = 1, fs=None, journal: RenameJournal = None,
+                 exact: bool = False):
+    """
+    Rename multiple files. Directories are renamed concurrently by a pool of threads,
+    renames within a single directory are always executed in order by one thread.
 
-def process_single_output(value, output: Dict[str, Any]):
-    if "index" not in output:
-        print(f":: index not defined for {output}")
-        sys.exit(1)
+    Args:
+        file_data: iterable of (dir_name, file_name, new_file_name) tuples
+        workers (int): number of directories renamed concurrently
+        fs: file system, LocalFileSystem by default
+        journal (RenameJournal): optional journal recording every completed rename
+        exact (bool): files whose exact new name can not be used are not renamed
 
-    index = output["index"]
-    return {index: get_value(value, output)}
+    Returns:
+        tuple: (renamed_files, skipped_files, failed_files) tuple
+    """
 
+    skipped_files = []
+    renamed_files = {}
+    failed_files = []
+    fs = fs if fs is not None else LocalFileSystem()
+
+    def dir_renames():
+        for original_dir, group in groupby(file_data, key=lambda entry: entry[0]):
+            renames = []
+            for _, original_name, new_name in group:
+                if new_name is None:
+                    skipped_files.append(os.path.join(original_dir, original_name))
+                else:
+                    renames.append((original_name, new_name))
 
-def process_multi_output(values: List[Any], outputs: List[Any]):
-    if not isinstance(outputs, (list, tuple)) \
-            and (isinstance(values, (list, tuple)) or len(values) != len(outputs)):
-        print(":: multi output handling: count of values and outputs do not match")
-        sys.exit(1)
+            if renames:
+                yield original_dir, renames
 
-    if not isinstance(values, (list, tuple)):
-        values = [values] * len(outputs)
+    def collect(original_dir, renames, future):
+        targets, actual, conflicts = future.result()
+        counters["conflicts"] += conflicts
+        for original_name, new_name in renames:
+            original_file_path = os.path.join(original_dir, original_name)
+            actual_name = actual.get(original_name)
+            counters["planned_suffixes"] += targets.get(original_name, new_name) != new_name
+            if actual_name is None:
+                failed_files.append(original_file_path)
+            else:
+                counters["actual_suffixes"] += actual_name != new_name
+                renamed_files[os.path.join(original_dir, actual_name)] = {
+                    "original_path": original_file_path,
+                    "proposed_name": new_name,
+                    "proposed_is_different": actual_name != new_name
+                }
+
+    with ThreadPoolExecutor(workers) as executor:
+        pending = deque()
+        running = {}
+        for original_dir, renames in dir_renames():
+            # same directory may appear again later, keep its renames ordered
+            if original_dir in running:
+                running[original_dir].result()
+
+            future = executor.submit(rename_dir, fs, original_dir, renames, journal, exact)
+            running[original_dir] = future
+            pending.append((original_dir, renames, future))
+
+            while pending and (len(pending) > workers * 2 or pending[0][2].done()):
+                done_dir, done_renames, done_future = pending.popleft()
+                collect(done_dir, done_renames, done_future)
+                if running.get(done_dir) is done_future:
+                    del running[done_dir]
+
+        while pending:
+            collect(*pending.popleft())
 
-    result = {}
+    return renamed_files, skipped_files, failed_files
 
-    for i, value in enumerate(values):
-        output = outputs[i]
 
-        if "index" not in output:
-            print(f":: index not defined for {output}")
-            sys.exit(1)
+def rename_with_journal(args, file_data):
+    """
+    Rename multiple files recording every completed rename in journal, so an interrupted
+    run can be resumed. With --resume files already renamed according to journal are skipped.
 
-        index = output["index"]
-        value = get_value(value, output)
-        result[index] = value
+    Args:
+        args: parsed command line arguments
+        file_data: iterable of (dir_name, file_name, new_file_name) tuples
 
-    return result
+    Returns:
+        tuple: (renamed_files, skipped_files, failed_files) tuple
+    """
 
+    journal_path = args.journal if args.journal is not None else f"{args.save_path}.journal"
+    completed = {}
+    unrecovered = []
 
-def process_output(value, output: Dict[str, Any]):
-    if "type" not in output:
-        print(":: Output 'type' not specified")
-        sys.exit(1)
+    if args.resume:
+        completed, unrecovered = recover_journal(journal_path)
+        renamed_paths = {record["actual_new_path"] for record in completed.values()}
+        skipped_paths = set(completed) | renamed_paths | set(unrecovered)
+        file_data = (entry for entry in file_data
+                     if os.path.join(entry[0], entry[1]) not in skipped_paths)
+        print(f":: Resuming, {len(completed)} files already renamed")
 
-    if output["type"] == "single":
-        return process_single_output(value, output)
+    journal = RenameJournal(journal_path, append=args.resume)
+    try:
+        with Timer("renaming"):
+            renamed, skipped, failed = rename_files(file_data, args.rename_workers, journal=journal)
+    finally:
+        journal.close()
 
-    if output["type"] == "multi":
-        if "outputs" not in output:
-            print(":: outputs is mandatory for multi output type")
-            sys.exit(1)
+    failed.extend(unrecovered)
+    for original_path, record in completed.items():
+        renamed[record["actual_new_path"]] = {
+            "original_path": original_path,
+            "proposed_name": record["proposed_name"],
+            "proposed_is_different": os.path.basename(record["actual_new_path"]) != record["proposed_name"]
+        }
 
-        return process_multi_output(value, output["outputs"])
+    return renamed, skipped, failed
 
 
-def roman_to_int(s: str) -> int:
+def restore_generator(args):
     """
-    Converts a Roman numeral string to its integer equivalent.
+    Yields renames restoring files to their original names. Restore data is either
+    restore_data.json saved by rename command or rename journal in JSONL format.
+    Renames are grouped by directory, so that each directory is listed only once.
 
     Args:
-        s: The Roman numeral string (e.g., "IV", "IX", "MCMXCIV").
+        args: parsed command line arguments
 
     Returns:
-        The integer representation of the Roman numeral.
+        Generator of (dir_name, file_name, original_file_name) tuples
     """
-    roman_values = {
-        'I': 1, 'V': 5, 'X': 10, 'L': 50,
-        'C': 100, 'D': 500, 'M': 1000
-    }
 
-    total = 0
-    for i, x in enumerate(s):
-        current_value = roman_values[x]
+    if is_jsonl(args.load_from_file, args.input_format) or args.load_from_file.endswith('.journal'):
+        renamed = {record["actual_new_path"]: record
+                   for record in read_journal(args.load_from_file).values()}
+    else:
+        with open(args.load_from_file, 'r', encoding='utf-8') as f:
+            renamed = json.load(f)["renamed"]
+
+    entries = []
+    for actual_new_path, record in renamed.items():
+        original_path = record["original_path"]
+        if args.directory is not None and not any(
+                os.path.commonpath([os.path.abspath(original_path), os.path.abspath(d)]) == os.path.abspath(d)
+                for d in args.directory):
+            continue
+        if args.glob is not None and not any(fnmatch(original_path, g) for g in args.glob):
+            continue
 
-        if i + 1 < len(s) and current_value < roman_values[s[i+1]]:
-            current_value *= -1
+        entries.append((os.path.dirname(actual_new_path), os.path.basename(actual_new_path),
+                        os.path.basename(original_path)))
 
-        total += current_value
+    entries.sort(key=lambda entry: entry[0])
+    yield from entries
 
-    return total
 
+def iter_file_data(file_data):
+    """Yields (dir_name, file_name, new_file_name) tuples from nested dict of file names"""
 
-def get_title_page_details(pdf_path, page_number, nlp):
-    import pytesseract
+    for dir_name, file_mappings in file_data.items():
+        for file_name, new_name in file_mappings.items():
+            yield dir_name, file_name, new_name
 
-    images = convert_from_path(
-        pdf_path, first_page=page_number, last_page=page_number, dpi=100)
-    image_data = images[0]
-    if image_data is None:
-        return "Error: Could not extract image features."
 
-    text = pytesseract.image_to_string(image_data)
-    # print(f'{pdf_path}:{page_number}:: {text}')
-    # doc = nlp(text)
-    # for ent in doc.ents:
-    #    print(f"Entity: {ent.text}, Label: {ent.label_}")
+def read_jsonl_file_data(f):
+    """Yields (dir_name, file_name, new_file_name) tuples from JSONL file object"""
 
-    result = {
-        'page': page_number,
-    }
-    for t in text.split('\n'):
-        res = re.search(
-            r'.*Vol\s+(?P<volume>[^\s]*)\s+Nos?\s+(?P<nos>(?:(?:\s*and\s*)?(?:\d+))+)\s*(?P<date>.*)', t)
-        if res:
-            result['match'] = t
-            result['volume'] = roman_to_int(
-                res.group('volume').upper()) if res.group('volume') is not None else 0
-            result['nos'] = [int(i)
-                             for i in re.findall(r'(\d+)', res.group('nos'))]
-            entities = nlp(res.group('date'))
-            for e in entities.ents:
-                if e.label_ == "DATE":
-                    result['date'] = e.text
+    for line in f:
+        if line.strip():
+            record = json.loads(line)
+            yield record["dir_name"], record["file_name"], record["new_file_name"]
 
-    return result
 
+def is_jsonl(file_path: str, input_format: str):
+    """Checks if file names are stored in JSONL format, guessing from extension if format is not given"""
 
-async def detect_title_page(args, result):
-    """Detect title page"""
+    if input_format is not None:
+        return input_format == "jsonl"
 
-    import contextualSpellCheck
-    import spacy
+    return file_path.endswith(".jsonl")
 
-    nlp = spacy.load('en_core_web_sm')
-    contextualSpellCheck.add_to_pipe(nlp)
-    results = {}
-    for pdf_path, titles in result.items():
-        results[pdf_path] = []
-        for title in titles:
-            result = get_title_page_details(pdf_path, title, nlp)
-            results[pdf_path].append(result)
-    with open(args.save_path, 'w', encoding='utf-8') as f:
-        json.dump(results, f, indent=4)
 
+def save_file_names(names, save_path: str, output_format: str):
+    """
+    Saves generated file names
 
-def preprocess_file_name(file_name: str, strips: List[str]):
-    processed_line = file_name
-    if strips is not None:
-        for s in strips:
-            processed_line = processed_line.replace(s, '')
+    Args:
+        names: iterable of (dir_name, file_name, new_file_name) tuples
+        save_path (str): path of file to save data to
+        output_format (str): "json" for single nested dict, "jsonl" for one record
+                             per line written as soon as file name is generated
 
-    processed_line = re.sub(
-        r'\s+', ' ', re.sub(r'([-:.,()\[\]\{\}])', r' \1 ', processed_line.strip()))
+    Returns:
+        None
+    """
 
-    return processed_line
+    if output_format == "jsonl":
+        with open(save_path, "w", encoding="utf-8") as f:
+            for dir_name, file_name, new_name in names:
+                f.write(json.dumps({"dir_name": dir_name, "file_name": file_name,
+                                    "new_file_name": new_name}) + "\n")
+    else:
+        results = {}
+        for dir_name, file_name, new_name in names:
+            result = results.get(dir_name, {})
+            result[file_name] = new_name
+            results[dir_name] = result
+
+        with open(save_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(results, indent=4))
 
+    print(f':: Saved data to file {save_path}')
 
-def get_doc(file_name: str, strips: List[str]):
-    """Get spacy Doc object for given file"""
 
-    nlp: Language = nlp_data["nlp"]
-    processed_line = preprocess_file_name(file_name, strips)
-    return nlp(processed_line)
+class RenamerServer(socketserver.UnixStreamServer):
+    """
+    Long lived server keeping spacy pipeline, patterns and compiled templates loaded.
+    Patterns are reloaded whenever patterns file changes.
+    """
 
+    def __init__(self, args):
+        self.args = args
+        self.patterns_stat = None
+        self.model_nlp = None
+        if args.model is not None:
+            self.model_nlp = predict_init(args.model, args.load, not args.no_pattern_cache)
+        self.reload_patterns()
 
-def get_new_file_name(doc: Doc, mandatory: List[str], template_str: str):
-    env = Environment()
-    template = env.from_string(template_str)
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        super().__init__(args.socket, RenamerRequestHandler)
 
-    results = {}
+    def server_bind(self):
+        """Binds socket accessible only by the user running the server"""
 
-    for e in doc.ents:
-        if e.label_ not in nlp_data["patterns"]:
-            print(f":: {e.label_} is not supported")
-            sys.exit(1)
+        umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+        os.chmod(self.server_address, 0o600)
 
-        result = e._.actual_value
-        results = {**results, **result}
+    def reload_patterns(self):
+        """Loads patterns again if patterns file has changed since last load"""
 
-    try:
-        if mandatory is not None and not all(m in results for m in mandatory):
-            return None
-        rendered_output = template.render(**results)
-        # print(file_name, ' -> ',
-        #      [f'{d.text}' for d in doc], ' => ', rendered_output)
-        return rendered_output
-    except Exception as e:
-        print(e)
-        sys.exit(1)
+        try:
+            stat = os.stat(self.args.load)
+            patterns_stat = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            patterns_stat = None
+
+        if patterns_stat != self.patterns_stat or self.patterns_stat is None:
+            if self.patterns_stat is None:
+                nlp_init(self.args.load, not self.args.no_pattern_cache)
+                self.patterns_stat = patterns_stat
+                return
+
+            print(f":: Reloading patterns from {self.args.load}")
+            loaded = dict(nlp_data)
+            try:
+                nlp_init(self.args.load, not self.args.no_pattern_cache)
+            except (SystemExit, Exception) as e:
+                # file is loaded again by next request, as it may be still being edited
+                nlp_data.update(loaded)
+                if not isinstance(e, SystemExit):
+                    print(f":: Error while loading patterns: {type(e).__name__}: {e}")
+                print(":: Keeping previously loaded patterns")
+                return
+
+            self.patterns_stat = patterns_stat
+
+    def process(self, request: Dict[str, Any]):
+        """
+        Processes single request
+
+        Args:
+            request (dict): request with keys
+                            - "command" (one of "extract" or "predict")
+                            - "files" (list of absolute file or directory paths)
+                            - "template", "mandatory" and "excludes" as on command line
+                            - "rename" (rename files instead of only generating names)
+
+        Returns:
+            dict: response
+        """
+
+        self.reload_patterns()
+
+        predict = request["command"] == "predict"
+        if predict and self.model_nlp is None:
+            return {"error": "server was started without --model"}
+        if request["command"] not in ("extract", "predict"):
+            return {"error": f"unsupported command {request['command']}"}
+
+        options = argparse.Namespace(batch_size=self.args.batch_size,
+                                     mandatory=request.get("mandatory"),
+                                     template=request["template"])
+        nlp = self.model_nlp if predict else nlp_data["nlp"]
+        strips = None if predict else request.get("excludes")
+
+        names = list(generate_names(nlp, file_generator(request["files"]), strips, options))
+        if not request.get("rename"):
+            results = {}
+            for dir_name, file_name, new_name in names:
+                result = results.get(dir_name, {})
+                result[file_name] = new_name
+                results[dir_name] = result
+            return {"results": results}
+
+        renamed, skipped, failed = rename_files(iter(names))
+        return {"renamed": renamed, "skipped": skipped, "failed": failed}
+
+
+class RenamerRequestHandler(socketserver.StreamRequestHandler):
+    """Handles connection to RenamerServer, every line is a JSON request answered by a JSON line"""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.process(json.loads(line))
+            except SystemExit:
+                response = {"error": "request failed, see server output for details"}
+            except Exception as e:
+                response = {"error": f"{type(e).__name__}: {e}"}
+
+            self.wfile.write((json.dumps(response) + "\n").encode('utf-8'))
+            self.wfile.flush()
+
+
+def serve(args):
+    """Runs renamer server until interrupted"""
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    with RenamerServer(args) as server:
+        print(f":: Listening on {args.socket}")
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(args.socket)
 
 
-def extract(file_name: str, strips: List[str], mandatory: List[str], template_str: str):
-    """Extracts new file names"""
+def send_request(socket_path: str, request: Dict[str, Any]):
+    """
+    Sends request to renamer server and waits for response
 
-    doc = get_doc(file_name, strips)
-    return get_new_file_name(doc, mandatory, template_str)
+    Args:
+        socket_path (str): path of server's unix socket
+        request (dict): request, see RenamerServer.process
 
+    Returns:
+        dict: response
+    """
 
-def file_generator(files):
-    """Yields file to be processed"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(socket_path)
+        s.sendall((json.dumps(request) + "\n").encode('utf-8'))
+        with s.makefile('r', encoding='utf-8') as f:
+            line = f.readline()
 
-    file_paths = Queue()
-    for f in files:
-        file_paths.put(f)
+    if not line:
+        return {"error": "server closed connection without response"}
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return {"error": f"invalid response: {e}"}
 
-    while not file_paths.empty():
-        file_path = file_paths.get()
-        if os.path.isdir(file_path):
-            listing = os.listdir(file_path)
-            for l in listing:
-                file_paths.put(f"{file_path}/{l}")
-            continue
 
-        dir_name = os.path.dirname(file_path)
-        file_name = os.path.basename(file_path)
+def run_client(args):
+    """Sends command line request to renamer server and saves or prints the response"""
 
-        yield dir_name, file_name
+    request = {
+        "command": args.action,
+        "files": [os.path.abspath(f) for f in args.file],
+        "template": args.template,
+        "mandatory": args.mandatory,
+        "excludes": args.excludes,
+        "rename": args.rename,
+    }
 
+    try:
+        response = send_request(args.socket, request)
+    except OSError as e:
+        print(f":: Could not connect to server at {args.socket}: {e}")
+        sys.exit(1)
 
-def multi_extract(args):
-    """Extracts new file names"""
+    if "error" in response:
+        print(f":: Server error: {response['error']}")
+        sys.exit(1)
 
-    results = {}
-    nlp_init(args.load)
+    output = json.dumps(response.get("results", response), indent=4)
+    if args.save_path is None:
+        print(output)
+    else:
+        with open(args.save_path, "w", encoding="utf-8") as f:
+            f.write(output)
 
-    for dir_name, file_name in file_generator(args.file):
-        file_name_new = extract(
-            file_name, args.excludes, args.mandatory, args.template)
-        result = results.get(dir_name, {})
-        result[file_name] = file_name_new
-        results[dir_name] = result
 
-    return results
+class InotifyWatcher:
+    """Watches directory trees for new files using linux inotify"""
 
+    def __init__(self, dirs: List[str], args):
+        libc_name = ctypes.util.find_library('c')
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError("inotify is not supported")
 
-def multi_predict(args):
-    """Predict new file names"""
-    results = {}
-    nlp = spacy.load(args.model)
-    load_patterns(args.load)
-    Span.set_extension("actual_value", getter=get_actual_value)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
 
-    for dir_name, file_name in file_generator(args.file):
-        doc = nlp(preprocess_file_name(file_name, None))
-        file_name_new = get_new_file_name(doc, args.mandatory, args.template)
-        result = results.get(dir_name, {})
-        result[file_name] = file_name_new
-        results[dir_name] = result
+        self.args = args
+        self.watches = {}
+        # files created since watch started, only these are new when closed after writing
+        self.created = set()
+        for dir_name in dirs:
+            self.add_tree(dir_name, 0)
 
-    return results
+    def add_tree(self, dir_name: str, depth: int):
+        """Adds watches for directory and its sub directories"""
 
+        if self.args.max_depth is not None and depth >= self.args.max_depth:
+            return
 
-def generate_training_data(args):
-    """Generate training data"""
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dir_name), INOTIFY_MASK)
+        if wd < 0:
+            print(f":: Could not watch {dir_name}: {os.strerror(ctypes.get_errno())}")
+            return
+        self.watches[wd] = (dir_name.rstrip('/') or dir_name, depth)
 
-    nlp_init(args.load)
-    docs = []
+        with os.scandir(dir_name) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=not self.args.no_follow_symlinks) \
+                        and is_watched_name(entry.name, self.args, True):
+                    self.add_tree(entry.path, depth + 1)
 
-    for _, file_name in file_generator(args.file):
-        doc = get_doc(file_name, args.excludes)
-        docs.append(doc)
+    def wait(self, timeout: float):
+        """
+        Waits for new files
 
-    random.shuffle(docs)
-    split = (len(docs) * args.percentage) // 100
-    train_docs = docs[:split]
-    test_docs = docs[split:]
+        Args:
+            timeout (float): maximum time to wait in seconds, None to wait forever
 
-    return train_docs, test_docs
+        Returns:
+            list: (dir_name, file_name) tuples of new files
+        """
 
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
 
-def rename_file(original_path: str, new_name: str):
-    """Rename a file - if a file with new_name already exists a counter is used to generate unique name"""
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        new_files = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = struct.unpack_from('iIII', data, offset)
+            name = os.fsdecode(data[offset + 16:offset + 16 + length].rstrip(b'\0'))
+            offset += 16 + length
+
+            if mask & IN_Q_OVERFLOW:
+                print(":: Too many events, some new files may not be processed")
+            if wd not in self.watches:
+                continue
+            if mask & IN_IGNORED:
+                del self.watches[wd]
+                continue
+
+            dir_name, depth = self.watches[wd]
+            path = os.path.join(dir_name, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and is_watched_name(name, self.args, True):
+                    # files created before watch was added do not generate events
+                    self.add_tree(path, depth + 1)
+                    new_files.extend(file_generator([path], exclude=self.args.exclude_glob,
+                                                    max_depth=None if self.args.max_depth is None
+                                                    else self.args.max_depth - depth - 1,
+                                                    follow_symlinks=not self.args.no_follow_symlinks,
+                                                    skip_hidden=self.args.skip_hidden))
+            elif mask & IN_CREATE:
+                self.created.add(path)
+            elif mask & (IN_MOVED_FROM | IN_DELETE):
+                self.created.discard(path)
+            elif mask & IN_MOVED_TO or (mask & IN_CLOSE_WRITE and path in self.created):
+                new_files.append((dir_name, name))
+
+        return new_files
+
+    def close(self):
+        """Stops watching"""
+
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Watches directory trees for new files by listing them periodically"""
+
+    def __init__(self, dirs: List[str], args):
+        self.dirs = dirs
+        self.args = args
+        self.files = self.snapshot()
+
+    def snapshot(self):
+        """Returns set of (dir_name, file_name) tuples of all the watched files"""
+
+        return set(file_generator(self.dirs, include=None, exclude=self.args.exclude_glob,
+                                  max_depth=self.args.max_depth,
+                                  follow_symlinks=not self.args.no_follow_symlinks,
+                                  skip_hidden=self.args.skip_hidden))
+
+    def wait(self, timeout: float):
+        """Waits for next poll and returns (dir_name, file_name) tuples of new files"""
+
+        time.sleep(self.args.poll_interval)
+        files = self.snapshot()
+        new_files = sorted(files - self.files)
+        self.files = files
+        return new_files
+
+    def close(self):
+        """Stops watching"""
+
+
+def is_watched_name(name: str, args, is_dir: bool = False):
+    """Checks if file or directory name is selected by traversal options of watch command"""
+
+    if args.skip_hidden and name.startswith('.'):
+        return False
+    if args.exclude_glob is not None and any(fnmatch(name, e) for e in args.exclude_glob):
+        return False
+
+    return is_dir or args.include_glob is None or any(fnmatch(name, i) for i in args.include_glob)
+
+
+def watch(args):
+    """
+    Watches directories and renames new files as they arrive. Bursts of events are
+    debounced, files are processed once no new file arrived for --debounce seconds.
+    Every rename is recorded in the rename journal.
+    """
 
-    original_dir, _ = os.path.split(original_path)
-    original_base_name, original_ext = os.path.splitext(new_name)
+    nlp_init(args.load, not args.no_pattern_cache)
+    journal_path = args.journal if args.journal is not None else f"{args.save_path}.journal"
+    journal = RenameJournal(journal_path, append=True)
 
-    counter = 1
-    target_path = os.path.join(original_dir, new_name)
+    watcher = None
+    if not args.polling:
+        try:
+            watcher = InotifyWatcher(args.file, args)
+        except (OSError, AttributeError) as e:
+            print(f":: inotify not available ({e}), falling back to polling")
+    if watcher is None:
+        watcher = PollingWatcher(args.file, args)
 
-    while os.path.exists(target_path):
-        # Construct new name with suffix
-        suffixed_name = f"{original_base_name}-{counter}{original_ext}"
-        target_path = os.path.join(original_dir, suffixed_name)
-        counter += 1
+    print(f":: Watching {', '.join(args.file)}")
+    own_renames = set()
+    pending = {}
+    first_event = last_event = 0.0
 
     try:
-        # print(f"rename({original_path}, {target_path})")
-        os.rename(original_path, target_path)
-    except OSError as e:
-        print(f"Error renaming file: {e}")
-        return None
-
-    return target_path
+        while True:
+            new_files = watcher.wait(args.debounce if pending else None)
+            now = time.monotonic()
+
+            for dir_name, file_name in new_files:
+                path = os.path.join(dir_name, file_name)
+                if path in own_renames:
+                    own_renames.discard(path)
+                elif is_watched_name(file_name, args):
+                    if not pending:
+                        first_event = now
+                    pending[(dir_name, file_name)] = None
+                    last_event = now
+
+            if not pending or (now - last_event < args.debounce
+                               and now - first_event < args.debounce * DEBOUNCE_MAX_FACTOR):
+                continue
+
+            entries = sorted(entry for entry in pending if os.path.isfile(os.path.join(*entry)))
+            pending = {}
+
+            names = list(generate_names(nlp_data["nlp"], entries, args.excludes, args))
+            renamed, skipped, failed = rename_files(iter(names), journal=journal)
+            journal.sync()
+            for new_path, record in renamed.items():
+                if new_path != record['original_path']:
+                    own_renames.add(new_path)
+                    print(f":: Renamed {record['original_path']} -> {new_path}")
+            for path in skipped:
+                print(f":: Skipped {path}")
+            for path in failed:
+                print(f":: Failed {path}")
+    finally:
+        watcher.close()
+        journal.close()
+
+
+def is_stats_enabled(args):
+    """Checks if statistics are collected for this run"""
+
+    return args.stats or args.stats_file is not None
+
+
+def get_stats(elapsed: float):
+    """
+    Builds run statistics from counters
 
+    Args:
+        elapsed (float): wall clock time of the run in seconds
 
-def rename_files(file_data):
-    """Rename multiple files"""
+    Returns:
+        dict: statistics
+    """
 
-    skipped_files = []
-    renamed_files = {}
-    failed_files = []
+    stats = {
+        "elapsed_seconds": elapsed,
+        "files": counters["files"],
+        "files_per_second": counters["files"] / elapsed if elapsed else None,
+        "stages": {},
+        "labels": {},
+        "handlers": {},
+        "counters": {},
+    }
 
-    for original_dir, file_mappings in file_data.items():
-        for original_name, new_name in file_mappings.items():
-            original_file_path = os.path.join(original_dir, original_name)
-            if new_name is None:
-                skipped_files.append(original_file_path)
-            else:
-                actual_new_path = rename_file(original_file_path, new_name)
-                if actual_new_path is None:
-                    failed_files.append(original_file_path)
-                else:
-                    renamed_files[actual_new_path] = {
-                        "original_path": original_file_path,
-                        "proposed_name": new_name,
-                        "proposed_is_different": os.path.basename(actual_new_path) != new_name
-                    }
+    for key, value in sorted(counters.items()):
+        if key.startswith("time.handler.") or key.startswith("memo_miss."):
+            continue
+        if key.startswith("time."):
+            stats["stages"][key[len("time."):]] = value
+        elif key.startswith("label."):
+            stats["labels"][key[len("label."):]] = value
+        elif key.startswith("handler."):
+            name = key[len("handler."):]
+            misses = counters[f"memo_miss.{name}"]
+            stats["handlers"][name] = {"calls": value,
+                                       "seconds": counters[f"time.handler.{name}"],
+                                       "memo_hits": value - misses,
+                                       "memo_misses": misses,
+                                       "memo_hit_rate": (value - misses) / value if value else None}
+        elif key != "files":
+            stats["counters"][key] = value
+
+    if counters["unique_names"]:
+        stats["dedupe_ratio"] = counters["files"] / counters["unique_names"]
+
+    return stats
+
+
+def print_stats(stats):
+    """Prints run statistics summary"""
+
+    files_per_second = stats["files_per_second"] or 0
+    print(f":: Stats: {stats['files']} files in {stats['elapsed_seconds']:.3f} s "
+          f"({files_per_second:.1f} files/s)")
+    for stage, seconds in stats["stages"].items():
+        print(f"::   {stage:25} {seconds:10.3f} s")
+    for label, count in stats["labels"].items():
+        print(f"::   label {label:19} {count:10}")
+    for handler, data in stats["handlers"].items():
+        print(f"::   handler {handler:17} {data['calls']:10} calls {data['seconds']:10.3f} s, "
+              f"memo hit rate {(data['memo_hit_rate'] or 0) * 100:5.1f}%")
+    for key, value in stats["counters"].items():
+        print(f"::   {key:25} {value:10}")
+    if "dedupe_ratio" in stats:
+        print(f"::   {'dedupe_ratio':25} {stats['dedupe_ratio']:10.2f}")
+
+
+def positive_int(value: str):
+    """Argument type accepting only integers greater than zero"""
 
-    return renamed_files, skipped_files, failed_files
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: '{value}'")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer: '{value}'")
+    return number
 
 
 def add_generate_command(commands):
@@ -589,9 +3633,40 @@ def add_generate_command(commands):
     generate_cmd.add_argument('--percentage', type=int, default=75,
                               help='Percentage of training data to use for training (default: 75)')
     generate_cmd.add_argument('--training-save-path', type=str, default=TRAIN_DATA_PATH,
-                              help=f'Save path for training data (default: {TRAIN_DATA_PATH})')
+                              help=f'Directory of training data shards (default: {TRAIN_DATA_PATH})')
     generate_cmd.add_argument('--testing-save-path', type=str, default=TRAIN_DATA_DEV_PATH,
-                              help=f'Save path for test data (default: {TRAIN_DATA_DEV_PATH})')
+                              help=f'Directory of test data shards (default: {TRAIN_DATA_DEV_PATH})')
+    generate_cmd.add_argument('--shard-size', type=positive_int, default=SHARD_SIZE,
+                              help=f'Maximum number of docs in a shard (default: {SHARD_SIZE})')
+    generate_cmd.add_argument('--seed', type=int, default=0,
+                              help='Seed of split into training and test data (default: 0)')
+    generate_cmd.add_argument('--dedupe', action='store_true',
+                              help='Skip file names identical to an earlier one after preprocessing')
+
+
+def add_evaluate_command(commands):
+    """Add evaluate command"""
+
+    evaluate_cmd = commands.add_parser(
+        'evaluate', help='Compare accuracy and speed of rule based matching and trained model on test data')
+    evaluate_cmd.add_argument('-d', '--data', type=str, default=TRAIN_DATA_DEV_PATH,
+                              help=f'Test data saved by generate command (default: {TRAIN_DATA_DEV_PATH})')
+    evaluate_cmd.add_argument('-l', '--load', type=str, default=PATTERNS_PATH,
+                              help=f'File to load patterns from (default: {PATTERNS_PATH})')
+    evaluate_cmd.add_argument('--model', type=str, default=None,
+                              help='Trained model used by predict engine')
+    evaluate_cmd.add_argument('--engines', type=str, nargs='+', choices=['extract', 'fast', 'predict'],
+                              default=None,
+                              help='Evaluated engines, fast is extract with --engine fast '
+                              '(default: extract and predict if --model is given)')
+    evaluate_cmd.add_argument('-s', '--save-path', type=str, default=EVALUATION_PATH,
+                              help=f'Save path of results (default: {EVALUATION_PATH})')
+    evaluate_cmd.add_argument('--batch-size', type=positive_int, default=BATCH_SIZE,
+                              help=f'Number of docs processed together (default: {BATCH_SIZE})')
+    evaluate_cmd.add_argument('--latency-samples', type=int, default=LATENCY_SAMPLES,
+                              help=f'Number of docs processed one by one to measure latency (default: {LATENCY_SAMPLES})')
+    evaluate_cmd.add_argument('--no-pattern-cache', action='store_true',
+                              help=f'Do not use cache of rendered patterns stored in {CACHE_DIR}')
 
 
 def add_predict_arguments(predict_cmd, save_path):
@@ -615,6 +3690,20 @@ def add_common_extract_arguments(cmd):
                      help=f'File to load patterns from (default: {PATTERNS_PATH})')
     cmd.add_argument('--excludes', type=str, nargs='+', default=None,
                      help='Strings that should be excluded from input file names during processing (default: none)')
+    cmd.add_argument('--no-pattern-cache', action='store_true',
+                     help=f'Do not use cache of rendered patterns stored in {CACHE_DIR}')
+    cmd.add_argument('--batch-size', type=positive_int, default=BATCH_SIZE,
+                     help=f'Number of file names processed together by spacy pipeline (default: {BATCH_SIZE})')
+    cmd.add_argument('--include-glob', type=str, nargs='+', default=None,
+                     help='Only process files whose name matches any of the glob patterns (default: all)')
+    cmd.add_argument('--exclude-glob', type=str, nargs='+', default=None,
+                     help='Skip files and directories whose name matches any of the glob patterns (default: none)')
+    cmd.add_argument('--max-depth', type=int, default=None,
+                     help='Maximum depth of directories to descend into, 1 means only given directories (default: no limit)')
+    cmd.add_argument('--no-follow-symlinks', action='store_true',
+                     help='Do not descend into symlinked directories')
+    cmd.add_argument('--skip-hidden', action='store_true',
+                     help='Skip files and directories whose name starts with .')
     cmd.add_argument('file', type=str, nargs='+',
                      help='File of directory to process')
 
@@ -625,24 +3714,48 @@ def add_extract_arguments(cmd, save_path=None):
     if save_path is not None:
         cmd.add_argument('-s', '--save-path', type=str, default=save_path,
                          help=f'Save path (default: {save_path})')
+        cmd.add_argument('--output-format', type=str, choices=['json', 'jsonl'], default='json',
+                         help='Format of saved data, jsonl writes one record per file as it is processed (default: json)')
     cmd.add_argument('-m', '--mandatory', type=str, nargs='+', default=None,
                      help='Fields that are mandatory in original file name (default: none)')
+    cmd.add_argument('--result-cache', type=str, default=None,
+                     help='SQLite file used to cache generated file names across runs (default: none)')
+    cmd.add_argument('--workers', type=positive_int, default=1,
+                     help='Number of worker processes used to generate new file names (default: 1)')
+    cmd.add_argument('--dedupe', action='store_true',
+                     help='Process each distinct preprocessed file name only once per run, '
+                     'even if it occurs in many directories')
     cmd.add_argument('-t', '--template', type=str, required=True,
                      help='template to be used to rename files. Use {attrib_name} for placeholders')
     add_common_extract_arguments(cmd)
 
 
+def add_engine_argument(cmd):
+    """Add argument selecting matching engine"""
+
+    cmd.add_argument('--engine', type=str, choices=['spacy', 'fast'], default='spacy',
+                     help='Engine matching patterns, fast evaluates them in pure python '
+                     'without spacy pipeline (default: spacy)')
+
+
 def add_extract_command(commands):
     """Add extract command"""
 
     predict_cmd = commands.add_parser(
         'extract', help='Extract new file names for given files based on specified rules')
+    add_engine_argument(predict_cmd)
     add_extract_arguments(predict_cmd, FILE_NAMES_PATH)
 
 
 def add_rename_arguments(cmd):
     cmd.add_argument('-s', '--save-path', type=str, default=RESTORE_PATH,
                      help=f'Save path (default: {RESTORE_PATH})')
+    cmd.add_argument('--rename-workers', type=positive_int, default=1,
+                     help='Number of directories renamed concurrently (default: 1)')
+    cmd.add_argument('--journal', type=str, default=None,
+                     help='Journal recording every completed rename (default: save path with .journal suffix)')
+    cmd.add_argument('--resume', action='store_true',
+                     help='Resume interrupted run, files already renamed according to journal are skipped')
 
 
 def add_rename_command(commands):
@@ -655,6 +3768,7 @@ def add_rename_command(commands):
 
     run_cmd = rename_commands.add_parser(
         'extract', help='Extract new file names and rename files')
+    add_engine_argument(run_cmd)
     add_extract_arguments(run_cmd)
     add_rename_arguments(run_cmd)
 
@@ -667,73 +3781,252 @@ def add_rename_command(commands):
         'from', help='Load saved data from file and rename files')
     from_cmd.add_argument('-l', '--load-from-file', type=str, default=FILE_NAMES_PATH,
                           help=f'Load title pages and pdf from file (default: {FILE_NAMES_PATH})')
+    from_cmd.add_argument('--input-format', type=str, choices=['json', 'jsonl'], default=None,
+                          help='Format of file names data (default: jsonl if file name ends with .jsonl, json otherwise)')
     add_rename_arguments(from_cmd)
 
 
+def add_restore_command(commands):
+    """Add restore command"""
+
+    restore_cmd = commands.add_parser(
+        'restore', help='Restore renamed files to their original names')
+    restore_cmd.add_argument('-l', '--load-from-file', type=str, default=RESTORE_PATH,
+                             help=f'Load restore data or rename journal from file (default: {RESTORE_PATH})')
+    restore_cmd.add_argument('--input-format', type=str, choices=['json', 'jsonl'], default=None,
+                             help='Format of restore data, jsonl for rename journal '
+                             '(default: jsonl if file name ends with .jsonl or .journal, json otherwise)')
+    restore_cmd.add_argument('--directory', type=str, nargs='+', default=None,
+                             help='Only restore files in given directories and their sub directories (default: all)')
+    restore_cmd.add_argument('--glob', type=str, nargs='+', default=None,
+                             help='Only restore files whose original path matches any of the glob patterns (default: all)')
+    restore_cmd.add_argument('--rename-workers', type=positive_int, default=1,
+                             help='Number of directories restored concurrently (default: 1)')
+
+
+def add_watch_command(commands):
+    """Add watch command"""
+
+    watch_cmd = commands.add_parser(
+        'watch', help='Watch directories and rename new files as they arrive')
+    watch_cmd.add_argument('-m', '--mandatory', type=str, nargs='+', default=None,
+                           help='Fields that are mandatory in original file name (default: none)')
+    watch_cmd.add_argument('-t', '--template', type=str, required=True,
+                           help='template to be used to rename files. Use {attrib_name} for placeholders')
+    watch_cmd.add_argument('-s', '--save-path', type=str, default=RESTORE_PATH,
+                           help=f'Restore data path, journal is saved next to it (default: {RESTORE_PATH})')
+    watch_cmd.add_argument('--journal', type=str, default=None,
+                           help='Journal recording every completed rename (default: save path with .journal suffix)')
+    watch_cmd.add_argument('--debounce', type=float, default=0.5,
+                           help='Seconds without new files before renaming them (default: 0.5)')
+    watch_cmd.add_argument('--polling', action='store_true',
+                           help='Poll directories instead of using inotify')
+    watch_cmd.add_argument('--poll-interval', type=float, default=0.5,
+                           help='Seconds between directory listings when polling (default: 0.5)')
+    add_common_extract_arguments(watch_cmd)
+
+
+def add_detect_command(commands):
+    """Add detect command"""
+
+    detect_cmd = commands.add_parser(
+        'detect', help='Detect volume, issue numbers and date on title pages of pdf files using OCR')
+    detect_cmd.add_argument('-l', '--load-from-file', type=str, default=TITLE_PAGES_PATH,
+                            help=f'Load title page numbers of pdf files from file (default: {TITLE_PAGES_PATH})')
+    detect_cmd.add_argument('-s', '--save-path', type=str, default=DETAILS_PATH,
+                            help=f'Save path (default: {DETAILS_PATH})')
+    detect_cmd.add_argument('--output-format', type=str, choices=['json', 'jsonl'], default='json',
+                            help='Format of saved data, jsonl writes one record per page as soon as it is finished (default: json)')
+    detect_cmd.add_argument('--ocr-workers', type=positive_int, default=os.cpu_count() or 1,
+                            help='Number of worker processes rasterizing and OCRing pages (default: number of CPUs)')
+    detect_cmd.add_argument('--ocr-cache', type=str, default=OCR_CACHE_PATH,
+                            help=f'SQLite file caching OCR text of pages (default: {OCR_CACHE_PATH})')
+    detect_cmd.add_argument('--no-ocr-cache', action='store_true',
+                            help='Do not use cache of OCR text')
+    detect_cmd.add_argument('--dpi', type=int, default=OCR_DPI,
+                            help=f'Resolution of rasterized pages (default: {OCR_DPI})')
+    detect_cmd.add_argument('--model', type=str, default=OCR_MODEL,
+                            help=f'spacy model used to find dates (default: {OCR_MODEL})')
+    detect_cmd.add_argument('--batch-size', type=positive_int, default=BATCH_SIZE,
+                            help=f'Maximum number of finished pages parsed together by spacy (default: {BATCH_SIZE})')
+
+
+def add_serve_command(commands):
+    """Add serve command"""
+
+    serve_cmd = commands.add_parser(
+        'serve', help='Run server keeping spacy pipeline loaded, see client command')
+    serve_cmd.add_argument('--socket', type=str, default=SOCKET_PATH,
+                           help=f'Unix socket to listen on (default: {SOCKET_PATH})')
+    serve_cmd.add_argument('-l', '--load', type=str, default=PATTERNS_PATH,
+                           help=f'File to load patterns from, reloaded when changed (default: {PATTERNS_PATH})')
+    serve_cmd.add_argument('--model', type=str, default=None,
+                           help='Model path to use to predict new file names (default: none)')
+    serve_cmd.add_argument('--no-pattern-cache', action='store_true',
+                           help=f'Do not use cache of rendered patterns stored in {CACHE_DIR}')
+    serve_cmd.add_argument('--batch-size', type=positive_int, default=BATCH_SIZE,
+                           help=f'Number of file names processed together by spacy pipeline (default: {BATCH_SIZE})')
+
+
+def add_client_command(commands):
+    """Add client command"""
+
+    client_cmd = commands.add_parser(
+        'client', help='Send extract or predict request to server started with serve command')
+    client_cmd.add_argument('action', type=str, choices=['extract', 'predict'],
+                            help='Generate new file names using rules or trained model')
+    client_cmd.add_argument('--socket', type=str, default=SOCKET_PATH,
+                            help=f'Unix socket of server (default: {SOCKET_PATH})')
+    client_cmd.add_argument('--rename', action='store_true',
+                            help='Rename files, response contains restore data')
+    client_cmd.add_argument('-s', '--save-path', type=str, default=None,
+                            help='Save path of response (default: print response)')
+    client_cmd.add_argument('-m', '--mandatory', type=str, nargs='+', default=None,
+                            help='Fields that are mandatory in original file name (default: none)')
+    client_cmd.add_argument('-t', '--template', type=str, required=True,
+                            help='template to be used to rename files. Use {attrib_name} for placeholders')
+    client_cmd.add_argument('--excludes', type=str, nargs='+', default=None,
+                            help='Strings that should be excluded from input file names during processing (default: none)')
+    client_cmd.add_argument('file', type=str, nargs='+',
+                            help='File of directory to process')
+
+
 def parse_args():
     """Parses command line arguments"""
 
     parser = argparse.ArgumentParser(description='multi file renamer')
+    parser.add_argument('--stats', action='store_true',
+                        help='Print time spent in each stage and entity, handler and file counts')
+    parser.add_argument('--stats-file', type=str, default=None,
+                        help='Save statistics as JSON to this file')
+    parser.add_argument('--profile', type=str, default=None,
+                        help='Run under cProfile and save pstats data to this file '
+                        '(worker processes are not profiled)')
 
     commands = parser.add_subparsers(
         dest='command', help='Available commands', required=True)
     add_generate_command(commands)
+    add_evaluate_command(commands)
     add_extract_command(commands)
     add_predict_command(commands)
     add_rename_command(commands)
+    add_restore_command(commands)
+    add_watch_command(commands)
+    add_detect_command(commands)
+    add_serve_command(commands)
+    add_client_command(commands)
 
     return parser.parse_args()
 
 
-async def main():
-    """The main function"""
-
-    args = parse_args()
+def run_command(args):
+    """Runs command selected on command line"""
 
     if args.command == "generate":
-        train_docs, test_docs = generate_training_data(args)
-
-        doc_bin = DocBin(docs=train_docs)
-        doc_bin.to_disk(args.training_save_path)
-        print(f":: Saved training data {args.training_save_path}")
-
-        doc_bin = DocBin(docs=test_docs)
-        doc_bin.to_disk(args.testing_save_path)
-        print(f":: Saved test data to {args.testing_save_path}")
-    elif args.command == "extract":
-        results = multi_extract(args)
+        train, test = generate_training_data(args)
+        if args.dedupe:
+            print(f":: Skipped duplicate file names: {counters['duplicates']}")
+        print(f":: Saved {train.docs} training docs in {train.shards} shards to {train.path}")
+        print(f":: Saved {test.docs} test docs in {test.shards} shards to {test.path}")
+    elif args.command == "evaluate":
+        results = evaluate(args)
         with open(args.save_path, "w", encoding="utf-8") as f:
-            f.write(json.dumps(results, indent=4))
-            print(f':: Saved data to file {args.save_path}')
+            json.dump(results, f, indent=4)
+        print(f":: Saved evaluation results to {args.save_path}")
+    elif args.command == "extract":
+        save_file_names(name_generator(args), args.save_path, args.output_format)
     elif args.command == "predict":
-        results = multi_predict(args)
-        with open(args.save_path, "w", encoding="utf-8") as f:
-            f.write(json.dumps(results, indent=4))
-            print(f':: Saved data to file {args.save_path}')
+        save_file_names(name_generator(args, predict=True),
+                        args.save_path, args.output_format)
     elif args.command == 'rename':
         try:
             if args.sub_command == 'extract':
-                results = multi_extract(args)
+                renamed, skipped, failed = rename_with_journal(
+                    args, iter_file_data(multi_extract(args)))
             elif args.sub_command == 'predict':
-                results = multi_predict(args)
+                renamed, skipped, failed = rename_with_journal(
+                    args, iter_file_data(multi_predict(args)))
             elif args.sub_command == 'from':
                 with open(args.load_from_file, 'r', encoding='utf-8') as f:
-                    results = json.load(f)
+                    if is_jsonl(args.load_from_file, args.input_format):
+                        renamed, skipped, failed = rename_with_journal(
+                            args, read_jsonl_file_data(f))
+                    else:
+                        renamed, skipped, failed = rename_with_journal(
+                            args, iter_file_data(json.load(f)))
 
-            renamed, skipped, failed = rename_files(results)
             results = {"renamed": renamed,
                        "skipped": skipped, "failed": failed}
             print(
                 f":: Out of total of {len(renamed) + len(skipped) + len(failed)}:: renamed: {len(renamed)}, skipped: {len(skipped)}, failed: {len(failed)}")
+            print(
+                f":: Suffixed names planned: {counters['planned_suffixes']}, actual: {counters['actual_suffixes']}")
             with open(args.save_path, "w", encoding="utf-8") as f:
                 f.write(json.dumps(results, indent=4))
                 print(f':: Saved restore data to file {args.save_path}')
         except (FileNotFoundError, PermissionError, IOError) as e:
             print(f'Error opening file ({args.load_from_file}): {e}')
+    elif args.command == 'watch':
+        watch(args)
+    elif args.command == 'detect':
+        try:
+            with open(args.load_from_file, 'r', encoding='utf-8') as f:
+                title_pages = json.load(f)
+        except (FileNotFoundError, PermissionError, IOError) as e:
+            print(f'Error opening file ({args.load_from_file}): {e}')
+            sys.exit(1)
+
+        save_title_page_details(detect_title_page(args, title_pages),
+                                sum(len(pages) for pages in title_pages.values()),
+                                args.save_path, args.output_format)
+    elif args.command == 'serve':
+        serve(args)
+    elif args.command == 'client':
+        run_client(args)
+    elif args.command == 'restore':
+        try:
+            with Timer("renaming"):
+                restored, _, failed = rename_files(
+                    restore_generator(args), args.rename_workers, exact=True)
+            print(
+                f":: Out of total of {len(restored) + len(failed)}:: restored: {len(restored)}, "
+                f"conflicts: {counters['conflicts']}, failed: {len(failed) - counters['conflicts']}")
+        except (FileNotFoundError, PermissionError, IOError) as e:
+            print(f'Error opening file ({args.load_from_file}): {e}')
+
+
+def main():
+    """The main function"""
+
+    args = parse_args()
+    stats_data["enabled"] = is_stats_enabled(args)
+    start = time.perf_counter()
+
+    try:
+        if args.profile is not None:
+            import cProfile
+
+            profiler = cProfile.Profile()
+            try:
+                profiler.runcall(run_command, args)
+            finally:
+                profiler.dump_stats(args.profile)
+                print(f":: Saved profile to {args.profile}")
+        else:
+            run_command(args)
+    finally:
+        if stats_data["enabled"]:
+            stats = get_stats(time.perf_counter() - start)
+            if args.stats:
+                print_stats(stats)
+            if args.stats_file is not None:
+                with open(args.stats_file, 'w', encoding='utf-8') as f:
+                    json.dump(stats, f, indent=4)
+                print(f":: Saved stats to {args.stats_file}")
 
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        main()
     except KeyboardInterrupt:
         pass